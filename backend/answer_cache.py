@@ -0,0 +1,182 @@
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers keyed on the question embedding.
+
+    A cached answer is reused when a new question retrieved the same chunk IDs
+    with the same k, and its embedding has a cosine similarity of at least
+    `similarity_threshold` with the cached question. Entries expire after
+    `ttl_seconds` and the least recently used entry is evicted once
+    `max_entries` is reached. If `db_path` is set, entries are also kept in a
+    SQLite file so they survive restarts; writes to it are queued and committed
+    in batches by a background thread, so callers never wait on the disk.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1000,
+        db_path: Optional[str] = None
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_signature: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        self._db = None
+        self._writes: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id TEXT PRIMARY KEY, signature TEXT, embedding BLOB, answer TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+            self._load()
+            self._writer = threading.Thread(
+                target=self._write_loop, name="answer-cache-writer", daemon=True
+            )
+            self._writer.start()
+
+    @staticmethod
+    def signature(k: int, chunk_ids: Sequence[Any]) -> str:
+        """Key shared by questions that retrieved the same chunks"""
+        joined = ",".join(str(chunk_id) for chunk_id in chunk_ids)
+        return hashlib.sha256(f"{k}|{joined}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, embedding: Sequence[float], k: int, chunk_ids: Sequence[Any]) -> Optional[str]:
+        """Return a cached answer for a similar question, or None"""
+        signature = self.signature(k, chunk_ids)
+        query = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id in list(self._by_signature.get(signature, ())):
+                entry = self._entries[entry_id]
+                if entry["expires_at"] <= now:
+                    self._remove(entry_id)
+                    self._stats["expirations"] += 1
+                    continue
+                score = float(np.dot(query, entry["embedding"]))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            return self._entries[best_id]["answer"]
+
+    def put(self, embedding: Sequence[float], k: int, chunk_ids: Sequence[Any], answer: str) -> None:
+        """Cache an answer for a question and its retrieved chunks"""
+        entry_id = uuid.uuid4().hex
+        entry = {
+            "signature": self.signature(k, chunk_ids),
+            "embedding": self._normalize(embedding),
+            "answer": answer,
+            "expires_at": time.time() + self.ttl_seconds
+        }
+
+        with self._lock:
+            self._insert(entry_id, entry)
+            if self._db is not None:
+                self._writes.put((
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                    (entry_id, entry["signature"], entry["embedding"].tobytes(), answer, entry["expires_at"])
+                ))
+
+    def close(self) -> None:
+        """Write out queued changes and close the SQLite file"""
+        if self._db is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._db.close()
+            self._db = None
+
+    def _write_loop(self) -> None:
+        # Each commit covers every write queued since the last one
+        while True:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for write in batch:
+                    if write is not None:
+                        self._db.execute(*write)
+                self._db.commit()
+            except sqlite3.Error as e:
+                print(f"Failed to persist answer cache: {e}")
+            if None in batch:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0
+            }
+
+    def _insert(self, entry_id: str, entry: Dict[str, Any]) -> None:
+        self._entries[entry_id] = entry
+        self._by_signature.setdefault(entry["signature"], set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self._remove(oldest_id)
+            self._stats["evictions"] += 1
+
+    def _remove(self, entry_id: str) -> None:
+        entry = self._entries.pop(entry_id)
+        ids = self._by_signature.get(entry["signature"])
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_signature[entry["signature"]]
+        if self._db is not None:
+            self._writes.put(("DELETE FROM answers WHERE id = ?", (entry_id,)))
+
+    def _load(self) -> None:
+        """Load unexpired entries from disk, oldest first so LRU order is preserved"""
+        now = time.time()
+        self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+        self._db.commit()
+        rows: List[tuple] = self._db.execute(
+            "SELECT id, signature, embedding, answer, expires_at FROM answers ORDER BY expires_at"
+        ).fetchall()
+        for entry_id, signature, embedding, answer, expires_at in rows:
+            self._insert(entry_id, {
+                "signature": signature,
+                "embedding": np.frombuffer(embedding, dtype=np.float32),
+                "answer": answer,
+                "expires_at": expires_at
+            })
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import Any, Optional
+
+import httpx
+
+from auth_config import Auth0Config
+
+
+class Auth0Client:
+    """
+    Shared async HTTP client for Auth0
+
+    Keeps a keep-alive connection pool, applies a default timeout to every call
+    (overridable per call) and caps the number of concurrent requests to Auth0
+    so a login spike queues here instead of overwhelming the tenant. Opened and
+    closed by the app lifespan; it is also opened lazily on first use.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 20,
+        max_concurrency: int = 20,
+        timeout: float = 10.0
+    ):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self.start()
+        return self._client
+
+    def start(self) -> None:
+        """Open the connection pool"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=httpx.Timeout(self.timeout)
+            )
+
+    async def close(self) -> None:
+        """Close the connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        timeout: Optional[float] = None,
+        **kwargs: Any
+    ) -> httpx.Response:
+        """Send a request to Auth0, waiting for a free concurrency slot first"""
+        async with self._semaphore:
+            return await self.client.request(
+                method,
+                path,
+                timeout=timeout if timeout is not None else self.timeout,
+                **kwargs
+            )
+
+    async def get(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+auth0_client = Auth0Client(
+    Auth0Config.BASE_URL,
+    max_connections=Auth0Config.HTTP_MAX_CONNECTIONS,
+    max_concurrency=Auth0Config.HTTP_MAX_CONCURRENCY,
+    timeout=Auth0Config.HTTP_TIMEOUT_SECONDS
+)
+
+class ManagementTokenError(RuntimeError):
+    """The Management API token could not be obtained"""
+
+class ManagementTokenProvider:
+    """
+    Cached Auth0 Management API token
+
+    The client-credentials token is reused until `refresh_margin` seconds before
+    its `expires_in`. Concurrent callers share a single in-flight refresh, and
+    after a failed refresh further attempts are refused until an exponential
+    backoff has elapsed, so an Auth0 outage is not amplified by retries.
+    """
+
+    def __init__(
+        self,
+        client: Auth0Client,
+        refresh_margin: float = 60,
+        min_backoff: float = 1,
+        max_backoff: float = 60
+    ):
+        self.client = client
+        self.refresh_margin = refresh_margin
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._lock = asyncio.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._last_error: Optional[Exception] = None
+
+    def _valid(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    async def get_token(self) -> str:
+        """Return a valid token, refreshing it if needed"""
+        if self._valid():
+            return self._token
+
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if self._valid():
+                return self._token
+
+            if time.monotonic() < self._retry_at:
+                raise ManagementTokenError(f"Backing off after failed refresh: {self._last_error}")
+
+            try:
+                response = await self.client.post("/oauth/token", json={
+                    "client_id": Auth0Config.CLIENT_ID,
+                    "client_secret": Auth0Config.CLIENT_SECRET,
+                    "audience": f"https://{Auth0Config.DOMAIN}/api/v2/",
+                    "grant_type": "client_credentials"
+                })
+                response.raise_for_status()
+                data = response.json()
+                if not isinstance(data, dict) or not data.get("access_token"):
+                    raise ManagementTokenError("Token response has no access_token")
+                lifetime = float(data.get("expires_in", 86400))
+            except Exception as e:
+                self._failures += 1
+                backoff = min(self.max_backoff, self.min_backoff * 2 ** (self._failures - 1))
+                self._retry_at = time.monotonic() + backoff
+                self._last_error = e
+                if isinstance(e, ManagementTokenError):
+                    raise
+                raise ManagementTokenError(f"Token refresh failed: {e}") from e
+
+            self._failures = 0
+            self._retry_at = 0.0
+            self._token = data["access_token"]
+            self._expires_at = time.monotonic() + max(0.0, lifetime - self.refresh_margin)
+            return self._token
+
+    def invalidate(self) -> None:
+        """Drop the cached token, e.g. after Auth0 rejects it"""
+        self._token = None
+        self._expires_at = 0.0
+
+management_token_provider = ManagementTokenProvider(auth0_client)
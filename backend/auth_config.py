@@ -10,12 +10,30 @@ class Auth0Config:
     API_AUDIENCE: str = os.getenv('AUTH0_API_AUDIENCE', '')
     ALGORITHMS: list = ["RS256"]
     ISSUER: str = f"https://{os.getenv('AUTH0_DOMAIN', '')}/"
+    # Override to point Auth0 calls at a local mock server
+    BASE_URL: str = os.getenv('AUTH0_BASE_URL', f"https://{os.getenv('AUTH0_DOMAIN', '')}")
     REDIRECT_URI: str = os.getenv('AUTH0_REDIRECT_URI', 'http://localhost:5174/callback')
     REDIRECT_URI: str = "http://localhost:5174/callback"
     
     # Auth0 Management API (for user management)
     CLIENT_ID: str = os.getenv('AUTH0_CLIENT_ID', '')
     CLIENT_SECRET: str = os.getenv('AUTH0_CLIENT_SECRET', '')
+
+    # Pooled HTTP client used for all Auth0 calls
+    HTTP_TIMEOUT_SECONDS: float = float(os.getenv('AUTH0_HTTP_TIMEOUT_SECONDS', '10'))
+    HTTP_MAX_CONNECTIONS: int = int(os.getenv('AUTH0_HTTP_MAX_CONNECTIONS', '20'))
+    HTTP_MAX_CONCURRENCY: int = int(os.getenv('AUTH0_HTTP_MAX_CONCURRENCY', '20'))
+
+    # How often signing keys are refreshed in the background
+    JWKS_TTL_SECONDS: int = int(os.getenv('AUTH0_JWKS_TTL_SECONDS', '3600'))
+
+    # Verified-token cache; tokens without exp are cached for the default TTL
+    TOKEN_CACHE_SIZE: int = int(os.getenv('AUTH0_TOKEN_CACHE_SIZE', '10000'))
+    TOKEN_CACHE_DEFAULT_TTL: int = int(os.getenv('AUTH0_TOKEN_CACHE_DEFAULT_TTL', '300'))
+
+    # Short-lived cache of /auth/user/me profiles
+    PROFILE_CACHE_SIZE: int = int(os.getenv('AUTH0_PROFILE_CACHE_SIZE', '10000'))
+    PROFILE_CACHE_TTL_SECONDS: int = int(os.getenv('AUTH0_PROFILE_CACHE_TTL_SECONDS', '60'))
     
     @classmethod
     def validate_config(cls) -> bool:
@@ -1,54 +1,129 @@
 from fastapi import HTTPException, Security, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
+from jose import jwt, jwk, JWTError
+import hashlib
 import requests
-from functools import lru_cache
+import threading
+import time
 from typing import Optional, Dict, Any
 from auth_config import Auth0Config
+from ttl_cache import TTLCache
 
 security = HTTPBearer()
 
-@lru_cache()
-def get_jwks() -> Dict[str, Any]:
-    """Fetch and cache Auth0 JWKS (JSON Web Key Set)"""
-    try:
-        jwks_url = f"https://{Auth0Config.DOMAIN}/.well-known/jwks.json"
-        response = requests.get(jwks_url)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to fetch JWKS: {str(e)}"
-        )
+class JWKSManager:
+    """
+    Auth0 signing keys, pre-parsed and indexed by key ID (kid)
+
+    A background thread refreshes the key set every `ttl_seconds`. A token with
+    an unknown kid (e.g. right after Auth0 rotates keys) triggers one refresh,
+    rate-limited to `min_refresh_interval` seconds, so verifying tokens signed by
+    known keys never does network I/O.
+    """
+
+    def __init__(
+        self,
+        jwks_url: str,
+        ttl_seconds: float = 3600,
+        min_refresh_interval: float = 30,
+        timeout: float = 5
+    ):
+        self.jwks_url = jwks_url
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, Any] = {}
+        self._refresh_lock = threading.Lock()
+        self._last_refresh_attempt = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> bool:
+        """Fetch the key set and swap in the parsed keys; keeps the old keys on failure"""
+        with self._refresh_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        # Called with self._refresh_lock held
+        self._last_refresh_attempt = time.monotonic()
+        try:
+            response = requests.get(self.jwks_url, timeout=self.timeout)
+            response.raise_for_status()
+            keys = {}
+            for key in response.json().get("keys", []):
+                if key.get("kty") != "RSA" or key.get("use", "sig") != "sig" or "kid" not in key:
+                    continue
+                keys[key["kid"]] = jwk.construct(key, key.get("alg", Auth0Config.ALGORITHMS[0]))
+            self._keys = keys
+            return True
+        except Exception as e:
+            print(f"Failed to refresh JWKS: {e}")
+            return False
+
+    def _refresh_if_allowed(self) -> None:
+        # Check and refresh under one lock, so callers that queued behind a
+        # refresh see its timestamp and do not fetch again
+        with self._refresh_lock:
+            if time.monotonic() - self._last_refresh_attempt >= self.min_refresh_interval:
+                self._refresh_locked()
+
+    async def get_key(self, kid: Optional[str]) -> Optional[Any]:
+        """Return the parsed key for a kid, refreshing once if it is unknown"""
+        key = self._keys.get(kid)
+        if key is None and kid:
+            await run_in_threadpool(self._refresh_if_allowed)
+            key = self._keys.get(kid)
+        return key
 
-def get_rsa_key(token: str) -> Optional[Dict[str, Any]]:
-    """Extract RSA key from JWKS for token verification"""
+    def _run(self) -> None:
+        self.refresh()
+        while not self._stop.wait(self.ttl_seconds):
+            self.refresh()
+
+    def start(self) -> None:
+        """Start the background refresh thread"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="jwks-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background refresh thread"""
+        self._stop.set()
+        self._thread = None
+
+jwks_manager = JWKSManager(
+    f"{Auth0Config.BASE_URL}/.well-known/jwks.json",
+    ttl_seconds=Auth0Config.JWKS_TTL_SECONDS
+)
+
+# Claims of already-verified tokens, keyed by token hash and expiring at the token's exp
+verified_token_cache = TTLCache(
+    max_entries=Auth0Config.TOKEN_CACHE_SIZE,
+    default_ttl=Auth0Config.TOKEN_CACHE_DEFAULT_TTL
+)
+
+def token_cache_key(token: str) -> str:
+    """Hash of a bearer token, so raw tokens are never held as cache keys"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+async def get_rsa_key(token: str) -> Optional[Any]:
+    """Look up the parsed RSA key matching the token's kid"""
     try:
         unverified_header = jwt.get_unverified_header(token)
-        jwks = get_jwks()
-        
-        rsa_key = {}
-        for key in jwks.get("keys", []):
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
-                break
-        
-        return rsa_key if rsa_key else None
-    except Exception:
+    except JWTError:
         return None
+    return await jwks_manager.get_key(unverified_header.get("kid"))
 
 async def verify_token(
     credentials: HTTPAuthorizationCredentials = Security(security)
 ) -> Dict[str, Any]:
     """
     Verify Auth0 JWT token and return decoded payload
+
+    Tokens that already passed verification are served from a cache until their
+    `exp`, skipping the RS256 signature check.
     
     Args:
         credentials: HTTP Authorization header credentials
@@ -60,10 +135,15 @@ async def verify_token(
         HTTPException: If token is invalid or verification fails
     """
     token = credentials.credentials
+    cache_key = token_cache_key(token)
+
+    cached_payload = verified_token_cache.get(cache_key)
+    if cached_payload is not None:
+        return cached_payload
     
     try:
         # Get RSA key for verification
-        rsa_key = get_rsa_key(token)
+        rsa_key = await get_rsa_key(token)
         
         if not rsa_key:
             raise HTTPException(
@@ -79,9 +159,14 @@ async def verify_token(
             audience=Auth0Config.API_AUDIENCE,
             issuer=Auth0Config.ISSUER
         )
+
+        exp = payload.get("exp")
+        verified_token_cache.set(cache_key, payload, expires_at=float(exp) if exp is not None else None)
         
         return payload
         
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=401,
@@ -1,7 +1,7 @@
+import httpx
 from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Dict, Any
-import requests
 from auth_config import (
     Auth0Config, 
     SignUpRequest, 
@@ -10,31 +10,53 @@ from auth_config import (
     UserInfo
 )
 from auth_middleware import require_auth
+from auth0_client import auth0_client, management_token_provider
+from ttl_cache import TTLCache
 from urllib.parse import quote
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
-def get_management_api_token() -> str:
-    """Get Auth0 Management API token for user operations"""
-    url = f"https://{Auth0Config.DOMAIN}/oauth/token"
-    
-    payload = {
-        "client_id": Auth0Config.CLIENT_ID,
-        "client_secret": Auth0Config.CLIENT_SECRET,
-        "audience": f"https://{Auth0Config.DOMAIN}/api/v2/",
-        "grant_type": "client_credentials"
-    }
-    
+# Recently fetched profiles keyed by the token's sub; cleared on logout
+profile_cache = TTLCache(
+    max_entries=Auth0Config.PROFILE_CACHE_SIZE,
+    default_ttl=Auth0Config.PROFILE_CACHE_TTL_SECONDS
+)
+
+def invalidate_user_profile(user_id: str) -> None:
+    """Drop a user's cached profile so the next load fetches it from Auth0"""
+    profile_cache.pop(user_id)
+
+async def get_management_api_token() -> str:
+    """Get Auth0 Management API token for user operations (cached until shortly before expiry)"""
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()["access_token"]
+        return await management_token_provider.get_token()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to get management token: {str(e)}"
         )
 
+async def management_api_request(method: str, path: str, **kwargs: Any) -> httpx.Response:
+    """
+    Call the Auth0 Management API with the cached token
+
+    A 401 means the token was revoked or rotated early, so it is dropped and the
+    request retried once with a fresh one.
+    """
+    headers = kwargs.pop("headers", {})
+    for attempt in range(2):
+        mgmt_token = await get_management_api_token()
+        response = await auth0_client.request(
+            method,
+            path,
+            headers={**headers, "Authorization": f"Bearer {mgmt_token}"},
+            **kwargs
+        )
+        if response.status_code != 401 or attempt:
+            break
+        management_token_provider.invalidate()
+    return response
+
 @router.post("/signup", response_model=Dict[str, Any])
 async def signup(request: SignUpRequest):
     """
@@ -47,16 +69,7 @@ async def signup(request: SignUpRequest):
         User creation confirmation
     """
     try:
-        # Get management API token
-        mgmt_token = get_management_api_token()
-        
         # Create user in Auth0
-        url = f"https://{Auth0Config.DOMAIN}/api/v2/users"
-        headers = {
-            "Authorization": f"Bearer {mgmt_token}",
-            "Content-Type": "application/json"
-        }
-        
         user_data = {
             "email": request.email,
             "password": request.password,
@@ -68,7 +81,7 @@ async def signup(request: SignUpRequest):
             user_data["name"] = request.name
             user_data["given_name"] = request.name
         
-        response = requests.post(url, json=user_data, headers=headers)
+        response = await management_api_request("POST", "/api/v2/users", json=user_data)
         
         if response.status_code == 409:
             raise HTTPException(
@@ -106,8 +119,6 @@ async def login(request: LoginRequest):
         TokenResponse with access token and other auth details
     """
     try:
-        url = f"https://{Auth0Config.DOMAIN}/oauth/token"
-        
         payload = {
             "grant_type": "password",
             "username": request.email,
@@ -118,7 +129,7 @@ async def login(request: LoginRequest):
             "scope": "openid profile email"
         }
         
-        response = requests.post(url, json=payload)
+        response = await auth0_client.post("/oauth/token", json=payload)
         
         if response.status_code == 403:
             raise HTTPException(
@@ -182,8 +193,6 @@ async def exchange_code_for_token(code: str, redirect_uri: str):
         TokenResponse with access token
     """
     try:
-        url = f"https://{Auth0Config.DOMAIN}/oauth/token"
-        
         payload = {
             "grant_type": "authorization_code",
             "client_id": Auth0Config.CLIENT_ID,
@@ -193,7 +202,7 @@ async def exchange_code_for_token(code: str, redirect_uri: str):
             "audience": Auth0Config.API_AUDIENCE
         }
         
-        response = requests.post(url, json=payload)
+        response = await auth0_client.post("/oauth/token", json=payload)
         response.raise_for_status()
         data = response.json()
         
@@ -210,34 +219,18 @@ async def exchange_code_for_token(code: str, redirect_uri: str):
             detail=f"Token exchange failed: {str(e)}"
         )
 
-security = HTTPBearer()
-
-@router.get("/user/me", response_model=UserInfo)
-async def get_user_profile(
-    current_user: Dict[str, Any] = Depends(require_auth),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
-    """
-    Get current authenticated user's profile
-    
-    Args:
-        current_user: Current authenticated user (injected by dependency)
-        
-    Returns:
-        UserInfo with user profile details
-    """
+async def fetch_user_profile(user_id: str, access_token: str) -> UserInfo:
+    """Fetch a profile from Auth0's /userinfo, falling back to the Management API"""
     # First try /userinfo with the user's access token (works for social logins)
     try:
-        userinfo_url = f"https://{Auth0Config.DOMAIN}/userinfo"
-        ui_resp = requests.get(
-            userinfo_url,
-            headers={"Authorization": f"Bearer {credentials.credentials}"},
-            timeout=10
+        ui_resp = await auth0_client.get(
+            "/userinfo",
+            headers={"Authorization": f"Bearer {access_token}"}
         )
-        if ui_resp.ok:
+        if ui_resp.is_success:
             data = ui_resp.json()
             return UserInfo(
-                sub=data.get("sub", current_user.get("user_id")),
+                sub=data.get("sub", user_id),
                 email=data.get("email", ""),
                 email_verified=data.get("email_verified", False),
                 name=data.get("name"),
@@ -249,12 +242,8 @@ async def get_user_profile(
 
     # Fallback to Management API if /userinfo not available
     try:
-        mgmt_token = get_management_api_token()
-        user_id = current_user["user_id"]
         encoded_user_id = quote(user_id, safe="")
-        url = f"https://{Auth0Config.DOMAIN}/api/v2/users/{encoded_user_id}"
-        headers = {"Authorization": f"Bearer {mgmt_token}"}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = await management_api_request("GET", f"/api/v2/users/{encoded_user_id}")
         response.raise_for_status()
         user_data = response.json()
         return UserInfo(
@@ -268,6 +257,31 @@ async def get_user_profile(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch user profile: {str(e)}")
 
+security = HTTPBearer()
+
+@router.get("/user/me", response_model=UserInfo)
+async def get_user_profile(
+    current_user: Dict[str, Any] = Depends(require_auth),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Get current authenticated user's profile
+    
+    Args:
+        current_user: Current authenticated user (injected by dependency)
+        
+    Returns:
+        UserInfo with user profile details
+    """
+    user_id = current_user["user_id"]
+    cached_profile = profile_cache.get(user_id)
+    if cached_profile is not None:
+        return cached_profile
+
+    profile = await fetch_user_profile(user_id, credentials.credentials)
+    profile_cache.set(user_id, profile)
+    return profile
+
 @router.post("/logout")
 async def logout(current_user: Dict[str, Any] = Depends(require_auth)):
     """
@@ -282,6 +296,7 @@ async def logout(current_user: Dict[str, Any] = Depends(require_auth)):
     Returns:
         Logout confirmation
     """
+    invalidate_user_profile(current_user["user_id"])
     return {
         "message": "Logged out successfully",
         "logout_url": f"https://{Auth0Config.DOMAIN}/v2/logout?client_id={Auth0Config.CLIENT_ID}"
@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Dict
+
+
+def report(name: str, seconds: list) -> Dict[str, Any]:
+    """Print and return latency percentiles for a list of timings"""
+    seconds = sorted(seconds)
+    stats = {
+        "p50_us": seconds[len(seconds) // 2] * 1e6,
+        "p99_us": seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))] * 1e6,
+        "mean_us": sum(seconds) / len(seconds) * 1e6
+    }
+    print(f"{name:<28} p50 {stats['p50_us']:>9.1f} us   p99 {stats['p99_us']:>9.1f} us   "
+          f"mean {stats['mean_us']:>9.1f} us")
+    return stats
+
+async def time_calls(call: Callable, iterations: int, before_each: Callable = None) -> list:
+    timings = []
+    for _ in range(iterations):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def benchmark_auth(args):
+    """
+    Per-request cost of the verify_token -> get_current_user -> require_auth chain,
+    with and without the verified-token cache. Uses a locally generated RSA key,
+    so no Auth0 tenant is needed.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from fastapi.security import HTTPAuthorizationCredentials
+    from jose import jwk, jwt
+
+    import auth_middleware
+    from auth_config import Auth0Config
+
+    Auth0Config.API_AUDIENCE = "https://benchmark-api"
+    Auth0Config.ISSUER = "https://benchmark.auth0.local/"
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    auth_middleware.jwks_manager._keys = {"bench": jwk.construct(public_pem, "RS256")}
+
+    token = jwt.encode(
+        {
+            "sub": "auth0|benchmark",
+            "aud": Auth0Config.API_AUDIENCE,
+            "iss": Auth0Config.ISSUER,
+            "exp": int(time.time()) + 3600
+        },
+        private_pem,
+        algorithm="RS256",
+        headers={"kid": "bench"}
+    )
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    async def authenticate():
+        payload = await auth_middleware.verify_token(credentials)
+        user = await auth_middleware.get_current_user(payload)
+        return await auth_middleware.require_auth(user)
+
+    cache = auth_middleware.verified_token_cache
+    uncached = asyncio.run(time_calls(authenticate, args.iterations, before_each=cache.clear))
+    cache.clear()
+    cached = asyncio.run(time_calls(authenticate, args.iterations))
+
+    before = report("auth chain (no cache)", uncached)
+    after = report("auth chain (cached token)", cached)
+    print(f"speedup: {before['mean_us'] / after['mean_us']:.0f}x")
+
+def benchmark_retrieval(args):
+    """
+    Dense-only vs hybrid (dense + BM25 fused with RRF) search latency against the
+    Qdrant collection configured for the API. Needs a populated collection.
+    """
+    import main as api
+
+    async def run():
+        timings = {}
+        for mode, hybrid in (("dense", False), ("hybrid", True)):
+            samples = []
+            for question in args.questions:
+                embedding = await api.encode_question(question)
+                samples += await time_calls(
+                    lambda: api.search_points(question, embedding, args.k, hybrid=hybrid),
+                    args.iterations
+                )
+            timings[mode] = samples
+        await api.qdrant_client.close()
+        return timings
+
+    timings = asyncio.run(run())
+    dense = report("search (dense only)", timings["dense"])
+    hybrid = report("search (hybrid RRF)", timings["hybrid"])
+    print(f"hybrid overhead: {hybrid['p50_us'] / dense['p50_us']:.2f}x p50")
+
+def benchmark_batch(args):
+    """
+    End-to-end throughput of sequential /query calls vs one /query/batch call
+    against a running API. Needs a valid access token.
+    """
+    import json
+    import httpx
+
+    with open(args.questions_file) as f:
+        questions = [line.strip() for line in f if line.strip()]
+    headers = {"Authorization": f"Bearer {args.token}"}
+
+    with httpx.Client(base_url=args.url, headers=headers, timeout=None) as client:
+        start = time.perf_counter()
+        for question in questions:
+            client.post("/query", json={"question": question, "k": args.k}).raise_for_status()
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        received = 0
+        with client.stream("POST", "/query/batch", json={
+            "queries": [{"question": question, "k": args.k} for question in questions]
+        }) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    json.loads(line)
+                    received += 1
+        batched = time.perf_counter() - start
+
+    print(f"{len(questions)} questions")
+    print(f"sequential /query   {sequential:8.1f} s   {len(questions) / sequential:6.2f} q/s")
+    print(f"/query/batch        {batched:8.1f} s   {received / batched:6.2f} q/s")
+    print(f"speedup: {sequential / batched:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the MarketSight API.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    auth_parser = subparsers.add_parser("auth", help="Per-request authentication overhead")
+    auth_parser.add_argument("--iterations", type=int, default=2000)
+    auth_parser.set_defaults(func=benchmark_auth)
+
+    retrieval_parser = subparsers.add_parser("retrieval", help="Dense vs hybrid search latency")
+    retrieval_parser.add_argument("--iterations", type=int, default=50)
+    retrieval_parser.add_argument("--k", type=int, default=5)
+    retrieval_parser.add_argument("--questions", nargs="+", default=[
+        "What was Apple's total revenue in fiscal 2023?",
+        "Describe NVDA data center segment growth",
+        "Risk factors related to supply chain concentration"
+    ])
+    retrieval_parser.set_defaults(func=benchmark_retrieval)
+
+    batch_parser = subparsers.add_parser("batch", help="Sequential /query vs /query/batch throughput")
+    batch_parser.add_argument("questions_file", help="Text file with one question per line")
+    batch_parser.add_argument("--token", required=True, help="Access token for the API")
+    batch_parser.add_argument("--url", default="http://localhost:8000")
+    batch_parser.add_argument("--k", type=int, default=5)
+    batch_parser.set_defaults(func=benchmark_batch)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
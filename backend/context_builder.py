@@ -0,0 +1,136 @@
+import re
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English prose)"""
+    return max(1, (len(text) + 3) // 4)
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    """Hashed word n-grams of a chunk, used to spot near-duplicates"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {
+        zlib.crc32(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def section_path(metadata: Optional[Dict[str, Any]]) -> str:
+    """Header path of a chunk, e.g. 'Item 7 > Liquidity and Capital Resources'"""
+    if not isinstance(metadata, dict):
+        return ""
+    return " > ".join(
+        value.strip() for _, value in sorted(metadata.items())
+        if isinstance(value, str) and value.strip()
+    )
+
+def truncate_to_tokens(
+    text: str,
+    max_tokens: int,
+    count_tokens: Callable[[str], int] = estimate_tokens
+) -> str:
+    """Longest whole-word prefix of `text` that fits in `max_tokens`"""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+def select_chunks(
+    results: List[Dict[str, Any]],
+    token_budget: int,
+    duplicate_threshold: float = 0.8,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    max_chunks: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Pick the chunks that go into the prompt, best first
+
+    `results` must be in relevance order and may hold more candidates than
+    `max_chunks`, so chunks that are dropped get replaced by the next ones. A
+    chunk is dropped when its shingle Jaccard similarity with an already
+    selected chunk reaches `duplicate_threshold` (e.g. the same boilerplate in
+    consecutive years' filings), or when it no longer fits in `token_budget`;
+    smaller chunks further down may still fit. The top chunk is always kept,
+    truncated to the budget if needed, so a hit is never answered with an empty
+    context.
+    """
+    selected: List[Dict[str, Any]] = []
+    selected_shingles: List[Set[int]] = []
+    used = 0
+
+    for result in results:
+        if max_chunks is not None and len(selected) >= max_chunks:
+            break
+
+        result_shingles = shingles(result["text"])
+        if any(jaccard(result_shingles, kept) >= duplicate_threshold for kept in selected_shingles):
+            continue
+
+        path_cost = count_tokens(section_path(result.get("metadata")))
+        cost = count_tokens(result["text"]) + path_cost
+        if used + cost > token_budget:
+            if selected:
+                continue
+            # A single oversized section (e.g. a whole 10-K item) is cut to fit
+            text = truncate_to_tokens(result["text"], max(0, token_budget - path_cost), count_tokens)
+            result = {**result, "text": text}
+            cost = count_tokens(text) + path_cost
+
+        selected.append(result)
+        selected_shingles.append(result_shingles)
+        used += cost
+
+    return selected
+
+def render_context(results: List[Dict[str, Any]]) -> str:
+    """
+    Format selected chunks as prompt context
+
+    Chunks are grouped by source file (ordered by each file's best-ranked chunk)
+    and runs of adjacent chunks are merged into one block. A chunk's header path
+    is written only when it differs from the previous chunk's in the same block.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        groups.setdefault(result["source"], []).append(result)
+
+    blocks = []
+    for source, chunks in groups.items():
+        chunks = sorted(chunks, key=lambda chunk: chunk["chunk_index"])
+
+        # Runs of consecutive chunk indexes become a single block
+        runs: List[List[Dict[str, Any]]] = []
+        for chunk in chunks:
+            if runs and chunk["chunk_index"] == runs[-1][-1]["chunk_index"] + 1:
+                runs[-1].append(chunk)
+            else:
+                runs.append([chunk])
+
+        for run in runs:
+            first, last = run[0]["chunk_index"], run[-1]["chunk_index"]
+            label = f"chunk {first}" if first == last else f"chunks {first}-{last}"
+            parts = [f"Source {len(blocks) + 1}: {source} ({label})"]
+            previous_path = None
+            for chunk in run:
+                path = section_path(chunk.get("metadata"))
+                if path and path != previous_path:
+                    parts.append(f"Section: {path}")
+                previous_path = path
+                parts.append(chunk["text"].strip())
+            blocks.append("\n".join(parts))
+
+    return "\n" + "=" * 50 + "\n" + ("\n" + "=" * 50 + "\n").join(blocks)
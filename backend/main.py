@@ -1,24 +1,57 @@
 import os
-from fastapi import FastAPI, Depends
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Depends, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Filter, FieldCondition, MatchAny, Prefetch, FusionQuery, Fusion, SparseVector,
+    QueryRequest as QdrantQueryRequest
+)
 from sentence_transformers import SentenceTransformer
 import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # Import authentication modules
-from auth_routes import router as auth_router
-from auth_middleware import require_auth
+from auth_routes import router as auth_router, profile_cache
+from auth_middleware import require_auth, jwks_manager, verified_token_cache
+from auth0_client import auth0_client
 from auth_config import Auth0Config
+from answer_cache import SemanticAnswerCache
+from marketsight_common.embedding_cache import EmbeddingCache
+from marketsight_common.sparse_encoder import SPARSE_VECTOR_NAME, encode_query
+from reranker import CrossEncoderReranker
+from context_builder import select_chunks, render_context
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the Auth0 client, start JWKS refresh and warm the reranker; release connections and threads on shutdown"""
+    auth0_client.start()
+    jwks_manager.start()
+    if RERANK_ENABLED:
+        # Load the cross-encoder now so the first query is not charged for it
+        await asyncio.get_running_loop().run_in_executor(rerank_executor, reranker.warm)
+    yield
+    jwks_manager.stop()
+    await auth0_client.close()
+    await qdrant_client.close()
+    encode_executor.shutdown(wait=False)
+    rerank_executor.shutdown(wait=False)
+    answer_cache.close()
+
 app = FastAPI(
     title="MarketSight API",
     description="Financial analysis API with 10-K filing insights and authentication",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -43,7 +76,7 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=GEMINI_API_KEY)
 
 # Initialize Qdrant client
-qdrant_client = QdrantClient(
+qdrant_client = AsyncQdrantClient(
     url=QDRANT_URL,
     api_key=QDRANT_API_KEY
 )
@@ -51,36 +84,113 @@ qdrant_client = QdrantClient(
 # Initialize embedding model
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
+# Bounded pool for CPU-bound encoding so it never runs on the event loop
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', '2'))
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+
+# Hybrid retrieval: fuse dense and BM25 results with reciprocal rank fusion
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+HYBRID_PREFETCH_LIMIT = int(os.getenv('HYBRID_PREFETCH_LIMIT', '50'))
+
+# Optional cross-encoder rerank of an over-fetched candidate set
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '50'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '300'))
+reranker = CrossEncoderReranker(
+    os.getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2'),
+    batch_size=int(os.getenv('RERANK_BATCH_SIZE', '16'))
+)
+
+# Separate pool so reranks never queue behind question encoding, or the reverse
+RERANK_WORKERS = int(os.getenv('RERANK_WORKERS', '1'))
+rerank_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+
+# Prompt context: token budget and near-duplicate threshold (shingle Jaccard)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '6000'))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+
+# Candidates per context chunk, so chunks dropped as duplicates or over budget get replaced
+CONTEXT_OVERFETCH = int(os.getenv('CONTEXT_OVERFETCH', '3'))
+
+# /query/batch limits: questions per request and concurrent Gemini calls across batches
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', '500'))
+BATCH_GEMINI_CONCURRENCY = int(os.getenv('BATCH_GEMINI_CONCURRENCY', '8'))
+batch_gemini_semaphore = asyncio.Semaphore(BATCH_GEMINI_CONCURRENCY)
+
+# Question embeddings, so repeats and client retries skip the encoder
+embedding_cache = EmbeddingCache(
+    capacity=int(os.getenv('EMBEDDING_CACHE_SIZE', '10000')),
+    dimension=embedding_model.get_sentence_embedding_dimension()
+)
+
 # Initialize Gemini model
 gemini_model = genai.GenerativeModel('gemini-2.5-flash')
 
+# Cache of generated answers for near-identical questions over the same chunks
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95')),
+    ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600')),
+    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000')),
+    db_path=os.getenv('ANSWER_CACHE_PATH') or None
+)
+
 class QueryRequest(BaseModel):
     question: str
     k: int = 5
+    tickers: Optional[List[str]] = None
+    years: Optional[List[int]] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+
+def build_query_filter(request: QueryRequest) -> Optional[Filter]:
+    """Qdrant filter restricting search to the requested tickers and fiscal years"""
+    conditions = []
+    if request.tickers:
+        conditions.append(FieldCondition(
+            key="ticker",
+            match=MatchAny(any=[ticker.upper() for ticker in request.tickers])
+        ))
+    if request.years:
+        conditions.append(FieldCondition(key="fiscal_year", match=MatchAny(any=request.years)))
+    return Filter(must=conditions) if conditions else None
+
+async def encode_question(question: str) -> List[float]:
+    """Embed a question on the encode pool without blocking the event loop"""
+    cached = embedding_cache.get(question)
+    if cached is not None:
+        return cached.tolist()
+
+    loop = asyncio.get_running_loop()
+    embedding = await loop.run_in_executor(encode_executor, embedding_model.encode, question)
+    embedding_cache.put(question, embedding)
+    return embedding.tolist()
+
+async def encode_questions(questions: List[str]) -> List[List[float]]:
+    """Embed many questions with one batched encoder call for the uncached ones"""
+    loop = asyncio.get_running_loop()
+    embeddings = await loop.run_in_executor(
+        encode_executor,
+        embedding_cache.get_or_compute,
+        questions,
+        lambda texts: embedding_model.encode(texts, batch_size=64)
+    )
+    return embeddings.tolist()
 
 def extract_text_from_metadata(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Extract and combine text from query result metadata"""
+    """
+    Shape query results for reranking and context assembly
+
+    Header metadata is kept separate from the chunk text; the context builder
+    writes it once per block instead of repeating it under every chunk.
+    """
     extracted_results = []
     
     for result in results:
-        # Extract text from content and metadata
-        text_content = result.get("content", "")
-        metadata = result.get("metadata", {})
-        
-        # Combine metadata text fields if they exist
-        metadata_text = ""
-        if isinstance(metadata, dict):
-            for key, value in metadata.items():
-                if isinstance(value, str) and value.strip():
-                    metadata_text += f"{key}: {value}\n"
-        
-        # Combine content with metadata text
-        combined_text = text_content
-        if metadata_text:
-            combined_text += f"\n\nMetadata:\n{metadata_text}"
-        
         extracted_results.append({
-            "text": combined_text,
+            "id": result.get("id"),
+            "text": result.get("content", ""),
+            "metadata": result.get("metadata", {}),
             "source": result.get("source_file", "Unknown"),
             "score": result.get("score", 0),
             "chunk_index": result.get("chunk_index", 0)
@@ -90,21 +200,11 @@ def extract_text_from_metadata(results: List[Dict[str, Any]]) -> List[Dict[str,
 
 def combine_context(extracted_results: List[Dict[str, Any]]) -> str:
     """Combine extracted texts to form context for Gemini"""
-    context_parts = []
-    
-    for i, result in enumerate(extracted_results, 1):
-        source_info = f"Source {i}: {result['source']}"
-        if result.get('chunk_index') is not None:
-            source_info += f" (chunk {result['chunk_index']})"
-        
-        context_part = f"{source_info}\n{result['text']}\n"
-        context_parts.append(context_part)
-    
-    return "\n" + "="*50 + "\n".join(context_parts)
+    return render_context(extracted_results)
 
-async def generate_answer_with_gemini(question: str, context: str) -> str:
-    """Generate answer using Google Gemini with context"""
-    prompt = f"""You are a financial analyst AI assistant specializing in analyzing 10-K filings for US publicly listed companies. Your role is to provide accurate, data-driven insights based on official SEC filings.
+def build_prompt(question: str, context: str) -> str:
+    """Build the Gemini prompt for a question and its retrieved context"""
+    return f"""You are a financial analyst AI assistant specializing in analyzing 10-K filings for US publicly listed companies. Your role is to provide accurate, data-driven insights based on official SEC filings.
 
 CONTEXT FROM 10-K FILINGS:
 {context}
@@ -138,18 +238,179 @@ RESPONSE FORMAT:
 
 Please provide your analysis now:"""
 
+async def generate_answer_with_gemini(
+    question: str,
+    question_embedding: List[float],
+    k: int,
+    extracted_results: List[Dict[str, Any]],
+    raise_errors: bool = False
+) -> str:
+    """
+    Generate an answer using Google Gemini with context
+
+    Answers to near-identical questions over the same chunks are served from the
+    answer cache; failed or blank generations are not cached. A failure is
+    returned as the answer text, or raised when `raise_errors` is set.
+    """
+    chunk_ids = [result["id"] for result in extracted_results]
+    answer = answer_cache.get(question_embedding, k, chunk_ids)
+    if answer is not None:
+        return answer
+
     try:
-        response = gemini_model.generate_content(prompt)
-        return response.text
+        response = await gemini_model.generate_content_async(
+            build_prompt(question, combine_context(extracted_results))
+        )
+        answer = response.text
     except Exception as e:
+        if raise_errors:
+            raise
         return f"Error generating response: {str(e)}"
 
+    if answer.strip():
+        answer_cache.put(question_embedding, k, chunk_ids, answer)
+    return answer
+
+def search_request(
+    question: str,
+    question_embedding: List[float],
+    limit: int,
+    query_filter: Optional[Filter] = None,
+    hybrid: bool = HYBRID_SEARCH
+) -> QdrantQueryRequest:
+    """
+    Qdrant query for a question, restricted to matching filings when a filter is given
+
+    In hybrid mode the dense and BM25 searches run as two prefetches of a single
+    request, executed concurrently by Qdrant and fused with reciprocal rank
+    fusion, so the returned scores are RRF scores rather than cosine similarities.
+    """
+    indices, values = encode_query(question) if hybrid else ([], [])
+    if not indices:
+        return QdrantQueryRequest(
+            query=question_embedding,
+            filter=query_filter,
+            limit=limit,
+            with_payload=True
+        )
+
+    candidates = max(limit, HYBRID_PREFETCH_LIMIT)
+    return QdrantQueryRequest(
+        prefetch=[
+            Prefetch(query=question_embedding, filter=query_filter, limit=candidates),
+            Prefetch(
+                query=SparseVector(indices=indices, values=values),
+                using=SPARSE_VECTOR_NAME,
+                filter=query_filter,
+                limit=candidates
+            )
+        ],
+        query=FusionQuery(fusion=Fusion.RRF),
+        limit=limit,
+        with_payload=True
+    )
+
+async def search_points(
+    question: str,
+    question_embedding: List[float],
+    limit: int,
+    query_filter: Optional[Filter] = None,
+    hybrid: bool = HYBRID_SEARCH
+) -> List[Any]:
+    """Search Qdrant for a single question"""
+    responses = await qdrant_client.query_batch_points(
+        collection_name=COLLECTION_NAME,
+        requests=[search_request(question, question_embedding, limit, query_filter, hybrid)]
+    )
+    return responses[0].points
+
+def context_pool(k: int) -> int:
+    """Candidates the context builder packs `k` chunks from"""
+    return k * max(1, CONTEXT_OVERFETCH)
+
+def search_limit(k: int) -> int:
+    """Hits to fetch for `k` context chunks; reranking over-fetches further"""
+    return max(context_pool(k), RERANK_CANDIDATES) if RERANK_ENABLED else context_pool(k)
+
+async def retrieve_context(
+    question: str,
+    question_embedding: List[float],
+    k: int,
+    query_filter: Optional[Filter] = None
+) -> List[Dict[str, Any]]:
+    """Search Qdrant for a question and select the hits that go into the prompt"""
+    search_results = await search_points(
+        question, question_embedding, search_limit(k), query_filter
+    )
+    return await select_context(question, search_results, k)
+
+async def select_context(
+    question: str,
+    search_results: List[Any],
+    k: int
+) -> List[Dict[str, Any]]:
+    """
+    Turn Qdrant hits into the chunks that go into the prompt
+
+    The hits are over-fetched candidates. With reranking enabled the best
+    context_pool(k) by cross-encoder score are kept, falling back to vector
+    order if scoring does not finish within RERANK_BUDGET_MS. Up to `k` chunks
+    are then packed under CONTEXT_TOKEN_BUDGET, skipping near-duplicates, with
+    later candidates taking the place of dropped ones.
+    """
+    # Format initial results
+    results = []
+    for result in search_results:
+        results.append({
+            "id": result.id,
+            "score": result.score,
+            "content": result.payload["content"],
+            "source_file": result.payload["source_file"],
+            "chunk_index": result.payload["chunk_index"],
+            "metadata": result.payload["metadata"]
+        })
+    
+    # Extract text from metadata
+    extracted_results = extract_text_from_metadata(results)
+    pool = context_pool(k)
+    if RERANK_ENABLED and len(extracted_results) > pool:
+        deadline = time.monotonic() + RERANK_BUDGET_MS / 1000
+        loop = asyncio.get_running_loop()
+        extracted_results = await loop.run_in_executor(
+            rerank_executor, reranker.rerank, question, extracted_results, pool, deadline
+        )
+
+    return select_chunks(
+        extracted_results[:pool],
+        CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+        max_chunks=k
+    )
+
+def format_sources(extracted_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Prepare the source list returned alongside an answer"""
+    return [
+        {
+            "source": result["source"],
+            "chunk_index": result["chunk_index"],
+            "score": result["score"]
+        }
+        for result in extracted_results
+    ]
+
 @app.get("/health")
 def health_check():
     """Public health check endpoint"""
     return {
         "status": "healthy",
-        "auth_configured": Auth0Config.validate_config()
+        "auth_configured": Auth0Config.validate_config(),
+        "caches": {
+            "answers": answer_cache.stats(),
+            "embeddings": embedding_cache.stats(),
+            "tokens": verified_token_cache.stats(),
+            "profiles": profile_cache.stats()
+        },
+        "reranker": reranker.stats() if RERANK_ENABLED else None
     }
 
 @app.get("/health/protected")
@@ -166,54 +427,189 @@ async def query_documents(
     request: QueryRequest,
     current_user: Dict[str, Any] = Depends(require_auth)
 ):
-    # Convert question to embedding
-    question_embedding = embedding_model.encode(request.question)
-    
-    # Search in Qdrant
-    search_results = qdrant_client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=question_embedding.tolist(),
-        limit=request.k,
-        with_payload=True
-    ).points
-    
-    # Format initial results
-    results = []
-    for result in search_results:
-        results.append({
-            "score": result.score,
-            "content": result.payload["content"],
-            "source_file": result.payload["source_file"],
-            "chunk_index": result.payload["chunk_index"],
-            "metadata": result.payload["metadata"]
-        })
-    
-    # Extract text from metadata
-    extracted_results = extract_text_from_metadata(results)
-    
-    # Combine context
-    context = combine_context(extracted_results)
+    # Retrieve context
+    question_embedding = await encode_question(request.question)
+    extracted_results = await retrieve_context(
+        request.question, question_embedding, request.k, build_query_filter(request)
+    )
     
-    # Generate answer with Gemini
-    answer = await generate_answer_with_gemini(request.question, context)
-    
-    # Prepare sources for response
-    sources = []
-    for result in extracted_results:
-        sources.append({
-            "source": result["source"],
-            "chunk_index": result["chunk_index"],
-            "score": result["score"]
-        })
+    # Generate answer with Gemini, reusing answers to near-identical questions
+    answer = await generate_answer_with_gemini(
+        request.question, question_embedding, request.k, extracted_results
+    )
     
     return {
         "question": request.question,
         "answer": answer,
-        "sources": sources,
+        "sources": format_sources(extracted_results),
         "context_used": len(extracted_results),
         "user_id": current_user["user_id"]
     }
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_gemini(prompt: str, queue: "asyncio.Queue[Any]") -> None:
+    """
+    Read a streamed Gemini answer into `queue`
+
+    Puts each piece of text, then None when the answer is complete, or the
+    exception if generation fails. Runs as its own task so the consumer can
+    cancel it; grpc aio cancels the upstream call when the task is cancelled.
+    """
+    try:
+        response = await gemini_model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if text:
+                await queue.put(text)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+@app.post("/query/stream")
+async def query_documents_stream(
+    request: QueryRequest,
+    http_request: Request,
+    current_user: Dict[str, Any] = Depends(require_auth)
+):
+    """
+    Stream an answer as Server-Sent Events
+
+    Sends a `sources` event with the retrieved chunks first, then `token` events
+    as Gemini produces text, and finally `done` (or `error`). If the client
+    disconnects, the upstream Gemini stream is cancelled. Cached answers are sent
+    as a single `token` event.
+    """
+    question_embedding = await encode_question(request.question)
+    extracted_results = await retrieve_context(
+        request.question, question_embedding, request.k, build_query_filter(request)
+    )
+    context = combine_context(extracted_results)
+    chunk_ids = [result["id"] for result in extracted_results]
+
+    async def event_stream():
+        yield sse_event("sources", {
+            "question": request.question,
+            "sources": format_sources(extracted_results),
+            "context_used": len(extracted_results)
+        })
+
+        cached_answer = answer_cache.get(question_embedding, request.k, chunk_ids)
+        if cached_answer is not None:
+            yield sse_event("token", {"text": cached_answer})
+            yield sse_event("done", {"user_id": current_user["user_id"], "cached": True})
+            return
+
+        answer_parts = []
+        queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=64)
+        producer = asyncio.create_task(
+            stream_gemini(build_prompt(request.question, context), queue)
+        )
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    yield sse_event("error", {"detail": f"Error generating response: {str(item)}"})
+                    return
+                # On disconnect Starlette cancels this generator; the explicit
+                # check covers servers that do not
+                if await http_request.is_disconnected():
+                    return
+                answer_parts.append(item)
+                yield sse_event("token", {"text": item})
+        finally:
+            # No-op once the answer is complete; otherwise stops the Gemini call
+            producer.cancel()
+
+        # A blank answer or one the client stopped reading is not worth serving again
+        answer = "".join(answer_parts)
+        if answer.strip() and not await http_request.is_disconnected():
+            answer_cache.put(question_embedding, request.k, chunk_ids, answer)
+        yield sse_event("done", {"user_id": current_user["user_id"], "cached": False})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch")
+async def query_documents_batch(
+    batch: BatchQueryRequest,
+    current_user: Dict[str, Any] = Depends(require_auth)
+):
+    """
+    Answer many questions in one request, streamed as NDJSON
+
+    All questions are embedded in one encoder call and searched with a single
+    Qdrant batch query; Gemini calls then run concurrently, capped at
+    BATCH_GEMINI_CONCURRENCY across all batches. Each line is one result,
+    written as soon as it completes, so lines are not in request order: use
+    `index` to match them to questions. A question that fails gets a line with
+    `index` and `error` instead of an answer.
+    """
+    queries = batch.queries
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BATCH_MAX_QUERIES} queries per batch"
+        )
+
+    embeddings = await encode_questions([query.question for query in queries])
+    responses = await qdrant_client.query_batch_points(
+        collection_name=COLLECTION_NAME,
+        requests=[
+            search_request(
+                query.question, embedding, search_limit(query.k), build_query_filter(query)
+            )
+            for query, embedding in zip(queries, embeddings)
+        ]
+    ) if queries else []
+
+    async def answer(index: int) -> Dict[str, Any]:
+        query, embedding = queries[index], embeddings[index]
+        extracted_results = await select_context(query.question, responses[index].points, query.k)
+        async with batch_gemini_semaphore:
+            answer_text = await generate_answer_with_gemini(
+                query.question, embedding, query.k, extracted_results, raise_errors=True
+            )
+        return {
+            "index": index,
+            "question": query.question,
+            "answer": answer_text,
+            "sources": format_sources(extracted_results),
+            "context_used": len(extracted_results)
+        }
+
+    async def answer_or_error(index: int) -> Dict[str, Any]:
+        # One failed question becomes an error line instead of ending the stream
+        try:
+            return await answer(index)
+        except Exception as e:
+            return {"index": index, "error": f"Error answering question: {str(e)}"}
+
+    async def result_stream():
+        tasks = [asyncio.create_task(answer_or_error(index)) for index in range(len(queries))]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                result["user_id"] = current_user["user_id"]
+                yield json.dumps(result) + "\n"
+        finally:
+            # Client went away: stop the remaining Gemini calls
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
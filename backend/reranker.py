@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    """
+    Reorders retrieved chunks by cross-encoder relevance to the question
+
+    Candidates are scored in batches on the CPU. Before each batch the running
+    average batch time is checked against `deadline` (taken before the call is
+    queued, so waiting for a worker counts against it); if the batch would not
+    finish in time, scoring stops and the candidates are returned in their
+    original vector order. Call warm() at startup to load the model and seed the
+    batch time, otherwise the first call pays for both.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_length: int = 512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model: Optional[CrossEncoder] = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reranked = 0
+        self._fallbacks = 0
+        self._batch_seconds = 0.0
+
+    @property
+    def model(self) -> CrossEncoder:
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = CrossEncoder(
+                        self.model_name, max_length=self.max_length, device="cpu"
+                    )
+        return self._model
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        start = time.monotonic()
+        scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        elapsed = time.monotonic() - start
+        with self._stats_lock:
+            # Moving average, so one slow batch does not disable reranking
+            if self._batch_seconds:
+                self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * elapsed
+            else:
+                self._batch_seconds = elapsed
+        return scores.tolist()
+
+    def warm(self) -> None:
+        """Load the model and time one full batch"""
+        self._predict([("warm up", "warm up")] * self.batch_size)
+
+    def _record(self, fallback: bool) -> None:
+        with self._stats_lock:
+            if fallback:
+                self._fallbacks += 1
+            else:
+                self._reranked += 1
+
+    def rerank(
+        self,
+        question: str,
+        candidates: List[Dict[str, Any]],
+        k: int,
+        deadline: float
+    ) -> List[Dict[str, Any]]:
+        """
+        Return the best `k` candidates, each with a `rerank_score`
+
+        `deadline` is a time.monotonic() timestamp. Falls back to the first `k`
+        candidates if every candidate cannot be scored before it.
+        """
+        if len(candidates) <= 1:
+            return candidates[:k]
+
+        scores: List[float] = []
+        for start in range(0, len(candidates), self.batch_size):
+            if time.monotonic() + self._batch_seconds >= deadline:
+                self._record(fallback=True)
+                return candidates[:k]
+            batch = candidates[start:start + self.batch_size]
+            scores.extend(self._predict([(question, candidate["text"]) for candidate in batch]))
+
+        self._record(fallback=False)
+        ranked = sorted(zip(scores, candidates), key=lambda pair: pair[0], reverse=True)
+        return [{**candidate, "rerank_score": score} for score, candidate in ranked[:k]]
+
+    def stats(self) -> Dict[str, Any]:
+        """How often reranking completed versus fell back to vector order"""
+        with self._stats_lock:
+            total = self._reranked + self._fallbacks
+            return {
+                "model": self.model_name,
+                "reranked": self._reranked,
+                "fallbacks": self._fallbacks,
+                "fallback_rate": self._fallbacks / total if total else 0.0,
+                "batch_ms": self._batch_seconds * 1000
+            }
@@ -0,0 +1 @@
+"""Components shared by the API (backend/) and the ingest scripts (scripts/)"""
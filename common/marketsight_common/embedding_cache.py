@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Bounded, thread-safe LRU cache of text embeddings.
+
+    Keys are digests of the normalized text (whitespace collapsed, case folded,
+    which all-MiniLM-L6-v2's uncased tokenizer ignores anyway), so long chunks
+    cost 20 bytes of key. Vectors live in one preallocated float32 matrix and
+    evicted slots are reused. `dimension` must match the embedding model's.
+    Used by the API for question embeddings and by the ingest scripts for
+    boilerplate chunks repeated across filings.
+    """
+
+    def __init__(self, capacity: int, dimension: int):
+        self.capacity = capacity
+        self.dimension = dimension
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._slots: "OrderedDict[bytes, int]" = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Digest of the normalized text"""
+        normalized = " ".join(text.split()).casefold()
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=20).digest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return a copy of the cached embedding, or None"""
+        key = self.key(text)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self._misses += 1
+                return None
+            self._slots.move_to_end(key)
+            self._hits += 1
+            return self._vectors[slot].copy()
+
+    def put(self, text: str, embedding: Sequence[float]) -> None:
+        """Store an embedding, evicting the least recently used one if full"""
+        if self.capacity <= 0:
+            return
+        key = self.key(text)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    _, slot = self._slots.popitem(last=False)
+                    self._evictions += 1
+                self._slots[key] = slot
+            else:
+                self._slots.move_to_end(key)
+            self._vectors[slot] = np.asarray(embedding, dtype=np.float32)
+
+    def get_or_compute(
+        self,
+        texts: List[str],
+        encode: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Embed texts, calling `encode` once with only the texts not in the cache
+
+        Returns a float32 matrix with one row per input text.
+        """
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        missing = []
+        for i, text in enumerate(texts):
+            cached = self.get(text)
+            if cached is None:
+                missing.append(i)
+            else:
+                embeddings[i] = cached
+
+        if missing:
+            computed = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self.put(texts[i], embedding)
+
+        return embeddings
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate statistics and current size"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "size": len(self._slots),
+                "capacity": self.capacity,
+                "hit_rate": self._hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,61 @@
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# Name of the sparse vector holding BM25 term weights in the Qdrant collection
+SPARSE_VECTOR_NAME = "bm25"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.'&-][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from
+further had has have having he her here hers him his how i if in into is it its itself
+just me more most my no nor not of off on once only or other our ours out over own same
+she should so some such than that the their theirs them then there these they this those
+through to too under until up very was we were what when where which while who whom why
+will with would you your yours
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stopwords removed; keeps tickers like brk.a and terms like 10-k"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def term_index(term: str) -> int:
+    """Stable sparse-vector dimension for a term (Python's hash() is salted per process)"""
+    return zlib.crc32(term.encode("utf-8"))
+
+def _to_sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    indices = sorted(weights)
+    return indices, [weights[index] for index in indices]
+
+def encode_document(
+    text: str,
+    k1: float = 1.2,
+    b: float = 0.75,
+    avg_doc_length: float = 256
+) -> Tuple[List[int], List[float]]:
+    """
+    BM25 term-frequency weights for a chunk as sparse (indices, values)
+
+    Only the document side of BM25 is computed here; the collection applies the
+    IDF modifier at query time, so adding or removing chunks never requires
+    re-weighting the rest of the index. `avg_doc_length` is a fixed estimate of
+    chunk length in tokens for the same reason.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return [], []
+
+    length_norm = k1 * (1 - b + b * len(tokens) / avg_doc_length)
+    weights: Dict[int, float] = {}
+    for term, count in Counter(tokens).items():
+        index = term_index(term)
+        weights[index] = weights.get(index, 0.0) + count * (k1 + 1) / (count + length_norm)
+    return _to_sparse(weights)
+
+def encode_query(text: str) -> Tuple[List[int], List[float]]:
+    """Sparse query vector with weight 1 per distinct term"""
+    return _to_sparse({term_index(term): 1.0 for term in set(tokenize(text))})
@@ -0,0 +1,223 @@
+import os
+import re
+import argparse
+import random
+import time
+
+
+def synthetic_documents(count, sections=40, words_per_section=180, seed=0):
+    """
+    Generate markdown documents shaped like 10-K filings.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        'revenue', 'operating', 'income', 'risk', 'factors', 'segment', 'goodwill',
+        'impairment', 'liquidity', 'capital', 'resources', 'fiscal', 'year', 'net',
+        'sales', 'growth', 'margin', 'expenses', 'research', 'development', 'market',
+        'competition', 'regulatory', 'customers', 'products', 'services', 'cash',
+        'flows', 'debt', 'interest', 'tax', 'company', 'results', 'compared', 'increase'
+    ]
+    documents = []
+    for doc_index in range(count):
+        parts = []
+        for section in range(sections):
+            parts.append(f"## Item {section} Section {section}")
+            parts.append(' '.join(rng.choice(vocabulary) for _ in range(words_per_section)))
+        documents.append({
+            'source_file': f"BENCH_10-K_{doc_index:06d}.md",
+            'etag': None,
+            'content': '\n\n'.join(parts),
+            'stored_ids': [],
+            'reusable_ids': []
+        })
+    return documents
+
+def run_embedding(documents, workers):
+    """
+    Split and embed documents, returning (chunks embedded, seconds elapsed).
+
+    The embedding cache is disabled, here and in spawned workers, so every
+    run encodes every chunk instead of reusing an earlier run's embeddings.
+    """
+    os.environ['EMBED_CACHE_SIZE'] = '0'
+    import process_and_embed
+
+    start = time.perf_counter()
+    if workers > 0:
+        windows = process_and_embed.process_documents_in_workers(iter(documents), workers)
+    else:
+        windows = process_and_embed.embed_documents(process_and_embed.split_documents(documents))
+    chunks = sum(len(window['points']) for window in windows)
+    return chunks, time.perf_counter() - start
+
+def benchmark_embedding(args):
+    """
+    Measure split+embed throughput for each worker count in args.workers.
+    """
+    documents = synthetic_documents(args.documents)
+    results = []
+    for workers in args.workers:
+        chunks, elapsed = run_embedding(documents, workers)
+        results.append((workers, chunks, elapsed))
+
+    baseline = next((chunks / elapsed for workers, chunks, elapsed in results if workers == 1), None)
+    print(f"\n{'workers':>8} {'chunks':>8} {'seconds':>9} {'chunks/sec':>11} {'speedup':>8}")
+    for workers, chunks, elapsed in results:
+        rate = chunks / elapsed
+        speedup = f"{rate / baseline:.2f}x" if baseline else '-'
+        print(f"{workers:>8} {chunks:>8} {elapsed:>9.2f} {rate:>11.1f} {speedup:>8}")
+
+def legacy_clean(text):
+    """
+    The former two-pass cleanup from fetch_reports.py, kept as the reference output.
+    """
+    text = re.sub(r'^(?:.*\|.*\|.*\n?)+', '', text, flags=re.MULTILINE)
+    return re.sub(re.compile('<[^>]+>'), '', text)
+
+def synthetic_filing(megabytes, seed=0):
+    """
+    Generate filing markdown with prose, tables, inline and multi-line HTML tags,
+    long paragraphs containing a single '|', and stray '<' comparisons.
+    """
+    rng = random.Random(seed)
+    words = ['revenue', 'net', 'income', 'segment', 'liquidity', 'fiscal', 'risk', 'capital']
+    target = int(megabytes * 1024 * 1024)
+    parts = []
+    size = 0
+    while size < target:
+        kind = rng.random()
+        if kind < 0.35:
+            sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(50, 400)))
+            part = f"{sentence} | {sentence}" if rng.random() < 0.3 else sentence
+        elif kind < 0.55:
+            rows = [f"| {rng.choice(words)} | {rng.randint(1, 10 ** 6):,} | {rng.randint(1, 10 ** 6):,} |"
+                    for _ in range(rng.randint(3, 30))]
+            part = '\n'.join(['| Item | 2024 | 2023 |', '|---|---|---|'] + rows)
+        elif kind < 0.75:
+            part = (f'<span style="font-weight:bold">{rng.choice(words)}</span> '
+                    f'{rng.choice(words)}<br/>{rng.choice(words)}')
+        elif kind < 0.85:
+            part = f'<div\n  class="note"\n>{rng.choice(words)}</div>'
+        elif kind < 0.95:
+            part = f"margin < {rng.randint(1, 99)}% of {rng.choice(words)}"
+        else:
+            part = f"## Item {rng.randint(1, 15)}. {rng.choice(words).title()}"
+        parts.append(part)
+        size += len(part) + 2
+    return '\n\n'.join(parts)
+
+def golden_cases(count, seed=0):
+    """
+    Hand-picked edge cases followed by random strings over the characters that matter.
+    """
+    cases = [
+        '', '|', '||', 'a|b|c', 'a|b|c\n', 'x\n|a|b|\ny', '<>', '<a>', '<<a>', '< a',
+        'a <b\nc> d', 'a <b\n|t|t|\nc> d', 'x\r\n|a|b|\r\ny', '<\n>', '|<|>|\n<x',
+        'a < b and c > d', 'end <', 'end <\n', '\n\n|a|\n|b|c|', 'a|b|c', '<x\u2028|a|b|>y'
+    ]
+    rng = random.Random(seed)
+    alphabet = ['a', ' ', '|', '<', '>', '\n', '\r']
+    for _ in range(count):
+        cases.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))))
+    return cases
+
+def benchmark_clean(args):
+    """
+    Check the single-pass cleaner against the legacy regexes, then time both.
+    """
+    from markdown_cleaner import clean_markdown
+
+    mismatches = [case for case in golden_cases(args.cases) if clean_markdown(case) != legacy_clean(case)]
+    for case in mismatches[:10]:
+        print(f"MISMATCH for {case!r}: {clean_markdown(case)!r} != {legacy_clean(case)!r}")
+
+    # Each '<' with no later '>' makes the legacy tag regex scan to the end of the text
+    inputs = [(f"{megabytes:g} MB filing", synthetic_filing(megabytes)) for megabytes in args.megabytes]
+    inputs.append(("0.25 MB of stray '<'", 'ratio < 1.0 and ' * 16384))
+
+    print(f"\n{'input':<22} {'legacy s':>10} {'single-pass s':>14} {'speedup':>9} {'identical':>10}")
+    for name, text in inputs:
+        start = time.perf_counter()
+        expected = legacy_clean(text)
+        legacy_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cleaned = clean_markdown(text)
+        seconds = time.perf_counter() - start
+        if cleaned != expected:
+            mismatches.append(text)
+        print(f"{name:<22} {legacy_seconds:>10.3f} {seconds:>14.4f} "
+              f"{legacy_seconds / seconds:>8.1f}x {str(cleaned == expected):>10}")
+
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} outputs differ from the legacy cleaner")
+    print(f"Golden check passed ({args.cases} random cases plus edge cases and filings)")
+
+def synthetic_statement(rows, boxed, seed=0):
+    """
+    Render a statement the way rich draws edgartools tables, boxed or space-aligned.
+    """
+    rng = random.Random(seed)
+    labels = ['Revenue', 'Cost of sales', 'Gross margin', 'Research and development',
+              'Operating income', 'Other income (expense), net', 'Net income']
+    body = [('ASSETS', '', '')] + [
+        (f"  {rng.choice(labels)}", f"${rng.randint(-10 ** 6, 10 ** 9):,}", f"({rng.randint(0, 10 ** 9):,})")
+        for _ in range(rows)
+    ]
+    header = ('Line Item', 'Sep 30, 2023', 'Sep 24, 2022')
+    widths = [max(len(row[i]) for row in body + [header]) for i in range(3)]
+
+    def line(cells, left, middle, right):
+        padded = [cells[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(cells[1:], widths[1:])]
+        return f"{left} " + f" {middle} ".join(padded) + f" {right}"
+
+    def rule(left, middle, right, fill):
+        return left + middle.join(fill * (width + 2) for width in widths) + right
+
+    title = 'Consolidated Statement of Operations'.center(sum(widths) + 10)
+    if boxed:
+        lines = [title, rule('┏', '┳', '┓', '━'), line(header, '┃', '┃', '┃'), rule('┡', '╇', '┩', '━')]
+        lines += [line(row, '│', '│', '│') for row in body] + [rule('└', '┴', '┘', '─')]
+    else:
+        lines = [title, line(header, ' ', ' ', ' '), ' ' + '─' * (sum(widths) + 8)]
+        lines += [line(row, ' ', ' ', ' ') for row in body]
+    return '\n'.join(lines)
+
+def benchmark_tables(args):
+    """
+    Time the local statement-to-markdown converter on synthetic statements.
+    """
+    from statement_converter import statement_to_markdown
+
+    for boxed in (False, True):
+        statements = [synthetic_statement(args.rows, boxed, seed) for seed in range(args.statements)]
+        start = time.perf_counter()
+        converted = sum(statement_to_markdown(text) is not None for text in statements)
+        elapsed = time.perf_counter() - start
+        layout = 'boxed' if boxed else 'space-aligned'
+        print(f"{layout:<14} {converted}/{len(statements)} converted, "
+              f"{elapsed / len(statements) * 1000:.2f} ms per {args.rows}-row statement")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the ingest pipeline.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    embed_parser = subparsers.add_parser('embed', help="Split+embed throughput by worker count")
+    embed_parser.add_argument('--documents', type=int, default=64)
+    embed_parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    embed_parser.set_defaults(func=benchmark_embedding)
+
+    clean_parser = subparsers.add_parser('clean', help="Markdown cleaner speed and golden check")
+    clean_parser.add_argument('--megabytes', type=float, nargs='+', default=[1, 4, 16])
+    clean_parser.add_argument('--cases', type=int, default=20000)
+    clean_parser.set_defaults(func=benchmark_clean)
+
+    tables_parser = subparsers.add_parser('tables', help="Local statement-to-markdown conversion speed")
+    tables_parser.add_argument('--statements', type=int, default=200)
+    tables_parser.add_argument('--rows', type=int, default=80)
+    tables_parser.set_defaults(func=benchmark_tables)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,24 @@
 import os
-import re
+import json
+import time
+import io
+import hashlib
+import random
+import argparse
+import asyncio
+import threading
+import httpx
 import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from edgar import set_identity, Company
 from dotenv import load_dotenv
-import time
 import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from botocore.config import Config
+from filing_cache import FilingCache
+from markdown_cleaner import clean_markdown
+from statement_converter import dataframe_rows, table_to_markdown, statement_to_markdown
+from s3_transfer import S3Uploader, PERIOD_OF_REPORT_KEY
 
 load_dotenv()
 
@@ -24,6 +37,24 @@ COMPANIES = {
 }
 
 REPORTS_DIR = 'data/raw_reports'
+
+# Local cache of downloaded filing content, so re-runs skip SEC downloads
+FILING_CACHE_DIR = 'data/filing_cache'
+FILING_CACHE_MAX_BYTES = int(os.getenv('FILING_CACHE_MAX_BYTES', str(5 * 1024 ** 3)))
+
+# Gemini conversions of tables the local converter cannot parse, keyed by table-text hash
+TABLE_CACHE_DIR = 'data/table_cache'
+TABLE_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# Concurrency and rate limits. SEC allows 10 requests per second; the SEC limit
+# is applied to every HTTP request edgartools sends, not per edgartools call.
+FETCH_WORKERS = 16
+SEC_REQUESTS_PER_SECOND = 8
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '30'))
+MAX_FILINGS_PER_FORM = 10
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0  # seconds, doubled per attempt with full jitter
+RETRY_MAX_DELAY = 30.0
 EMAIL_IDENTITY = 'Mozilla/5.0 (compatible; fetch_reports/1.0)'  # Replace with your email for SEC compliance
 
 # AWS S3 configuration
@@ -31,12 +62,19 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'ap-south-1')
 S3_BUCKET = os.getenv('S3_BUCKET')  # Set your bucket name in env
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # Optional local S3 stand-in (moto server, MinIO)
+
+# Uploads are compressed ('gzip', 'zstd' or 'identity') and skipped when unchanged
+UPLOAD_ENCODING = os.getenv('UPLOAD_ENCODING', 'gzip')
+UPLOAD_WORKERS = 8
 
 s3_client = boto3.client(
     's3',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+    region_name=AWS_REGION,
+    endpoint_url=S3_ENDPOINT_URL,
+    config=Config(max_pool_connections=FETCH_WORKERS + UPLOAD_WORKERS)
 )
 
 os.makedirs(REPORTS_DIR, exist_ok=True)
@@ -50,104 +88,375 @@ FORM_TYPES = ['10-K']
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # Replace with your Gemini API key
 GEMINI_API_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key=' + GEMINI_API_KEY
 
-def remove_tables(markdown_text):
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; acquire()
+    blocks until one is available. The default capacity of 1 allows no bursts,
+    so the limit holds over any one-second window.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+# Shared by all worker threads
+filing_cache = FilingCache(FILING_CACHE_DIR, FILING_CACHE_MAX_BYTES)
+table_cache = FilingCache(TABLE_CACHE_DIR, TABLE_CACHE_MAX_BYTES)
+s3_uploader = S3Uploader(s3_client, S3_BUCKET, max_workers=UPLOAD_WORKERS, encoding=UPLOAD_ENCODING)
+sec_limiter = TokenBucket(SEC_REQUESTS_PER_SECOND)
+gemini_limiter = TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60)
+
+def limit_sec_http_requests(limiter):
+    """
+    Take a token from `limiter` before every HTTP request sent to sec.gov.
+
+    edgartools sends its requests through httpx, so wrapping httpx's transports
+    covers every client it creates and charges each request separately, such as
+    the several that loading XBRL statements makes. Responses edgartools serves
+    from its own cache never reach the transport and are not charged.
+    """
+    def is_sec(request):
+        host = request.url.host
+        return host == 'sec.gov' or host.endswith('.sec.gov')
+
+    handle_request = httpx.HTTPTransport.handle_request
+    handle_async_request = httpx.AsyncHTTPTransport.handle_async_request
+
+    def limited_handle_request(self, request):
+        if is_sec(request):
+            limiter.acquire()
+        return handle_request(self, request)
+
+    async def limited_handle_async_request(self, request):
+        if is_sec(request):
+            await asyncio.to_thread(limiter.acquire)
+        return await handle_async_request(self, request)
+
+    httpx.HTTPTransport.handle_request = limited_handle_request
+    httpx.AsyncHTTPTransport.handle_async_request = limited_handle_async_request
+
+def with_retries(func, *args, limiter=None, description='request', **kwargs):
     """
-    Remove tables from the markdown text.
+    Call func, retrying failures with exponential backoff and full jitter.
+
+    Every attempt first takes a token from `limiter`, so retries count against
+    the rate limit too. The last failure is re-raised.
     """
-    pattern = r'^(?:.*\|.*\|.*\n?)+'
-    return re.sub(pattern, '', markdown_text, flags=re.MULTILINE)
+    for attempt in range(RETRY_ATTEMPTS):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            print(f"  {description} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-def remove_html_tags(text):
-    """Removes all HTML tags from a string."""
-    clean = re.compile('<[^>]+>')
-    return re.sub(clean, '', text)
+def sec_request(func, *args, description='SEC request', **kwargs):
+    """
+    Call an edgartools function that talks to SEC, retried on failure.
+
+    Rate limiting happens per HTTP request, see limit_sec_http_requests().
+    """
+    return with_retries(func, *args, description=description, **kwargs)
+
+def upload_to_s3(content, s3_key, filing):
+    """
+    Queue a compressed upload; it is skipped if S3 already holds the same content.
 
-def upload_to_s3(content, s3_key):
-    try:
-        s3_client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=content.encode('utf-8'))
-        print(f"  Uploaded to S3: s3://{S3_BUCKET}/{s3_key}")
-    except (NoCredentialsError, ClientError) as e:
-        print(f"  Error uploading to S3: {e}")
+    The filing's period of report goes into the object metadata, so the indexer
+    knows the fiscal year without guessing it from the text.
+    """
+    period_of_report = getattr(filing, 'period_of_report', None)
+    metadata = {PERIOD_OF_REPORT_KEY: str(period_of_report)} if period_of_report else None
+    s3_uploader.submit(content, s3_key, metadata)
 
 def save_filing_document(filing, ticker, form_type):
     """
     Save the main document of a filing (without tables) to AWS S3.
     """
     print(f"  [save_filing_document] Processing {form_type} for {ticker}...")
-    markdown_text = filing.markdown()
-    markdown_text = remove_tables(markdown_text)
-    markdown_text = remove_html_tags(markdown_text)
+    markdown_text = filing_cache.get_or_fetch(
+        filing.accession_number,
+        'document.md',
+        lambda: sec_request(filing.markdown, description=f"{ticker} {filing.accession_number} document")
+    )
+    markdown_text = clean_markdown(markdown_text)
     s3_key = f"{ticker}_{form_type}_{filing.accession_number}.md"
-    upload_to_s3(markdown_text, s3_key)
+    upload_to_s3(markdown_text, s3_key, filing)
 
-def save_filing_tables(filing, ticker, form_type):
+def request_gemini(prompt):
     """
-    Save the tables of a filing to AWS S3 as markdown tables using Google Gemini API.
+    Send a prompt to the Gemini API and return the JSON response.
     """
-    for key, value in filing.statements.detected_statements.items():
+    response = requests.post(
+        GEMINI_API_URL,
+        json={
+            "contents": [{"parts": [{"text": prompt}]}]
+        },
+        timeout=120
+    )
+    response.raise_for_status()
+    return response.json()
+
+def fetch_statement_data(filing, ticker):
+    """
+    Download the financial statements of a filing as
+    {statement_name: {'data': DataFrame JSON, 'text': text}}.
+
+    'data' is the statement's DataFrame as downloaded, serialized with
+    to_json(orient='split'), or None when it cannot be read; the rendered text
+    is kept for the fallback converters. Nothing is converted here, so changes
+    to the conversion never require downloading a filing again.
+    """
+    statements = sec_request(
+        lambda: filing.statements,
+        description=f"{ticker} {filing.accession_number} statements"
+    )
+    if statements is None:
+        return {}
+
+    tables = {}
+    for key, value in statements.detected_statements.items():
         statement_name = key.value
         if statement_name == 'balance':
             statement_name += '_sheet'
         else:
             statement_name += '_statement'
-        table = eval(f"filing.statements.{statement_name}")
-        if table is not None:
-            print(f"    [save_filing_tables] Processing table {statement_name}...")
-            table_text = table.text()
-            # Prepare prompt for Gemini
-            prompt = (
-                "Convert the following table to a markdown table. "
-                "Do not add any extra words, just output the markdown table.\n\n"
-                f"{table_text}"
+        table = getattr(statements, statement_name, None)
+        if table is None:
+            continue
+        try:
+            data = table.to_dataframe().to_json(orient='split', date_format='iso')
+        except Exception as e:
+            print(f"  Could not read {ticker} {statement_name} data, using its text: {e}")
+            data = None
+        tables[statement_name] = {'data': data, 'text': table.text()}
+    return tables
+
+def load_statement_data(filing, ticker):
+    """
+    Statement data of a filing, from the filing cache when already downloaded.
+    """
+    cached = filing_cache.get_or_fetch(
+        filing.accession_number,
+        'statement_data.json',
+        lambda: json.dumps(fetch_statement_data(filing, ticker))
+    )
+    return json.loads(cached)
+
+def statement_frame(data):
+    """
+    Rebuild a cached statement DataFrame, keeping period column names as strings.
+    """
+    return pd.read_json(io.StringIO(data), orient='split', convert_axes=False, convert_dates=False)
+
+def convert_table_with_gemini(table_text, description):
+    """
+    Convert a table to markdown with the Gemini API, caching the result by table-text hash.
+
+    Returns None if Gemini does not return a table; failures are not cached.
+    """
+    digest = hashlib.sha256(table_text.encode('utf-8')).hexdigest()
+    cached = table_cache.get(digest[:2], digest)
+    if cached is not None:
+        return cached
+
+    # Prepare prompt for Gemini
+    prompt = (
+        "Convert the following table to a markdown table. "
+        "Do not add any extra words, just output the markdown table.\n\n"
+        f"{table_text}"
+    )
+    print(f"      [save_filing_tables] Sending {description} to Gemini API...")
+    data = with_retries(
+        request_gemini,
+        prompt,
+        limiter=gemini_limiter,
+        description=f"Gemini {description}"
+    )
+    # Extract markdown from Gemini response
+    markdown_table = None
+    # Gemini's response format: data['candidates'][0]['content']['parts'][0]['text']
+    candidates = data.get('candidates', [])
+    if candidates:
+        parts = candidates[0].get('content', {}).get('parts', [])
+        if parts:
+            markdown_table = parts[0].get('text', '').strip()
+    if not markdown_table:
+        return None
+
+    table_cache.put(digest[:2], digest, markdown_table)
+    return markdown_table
+
+def save_filing_tables(filing, ticker, form_type):
+    """
+    Save the tables of a filing to AWS S3 as markdown tables.
+
+    Statements are converted locally from their structured data, or else from
+    their rendered text; only tables neither can handle are sent to the Google
+    Gemini API.
+    """
+    for statement_name, table in load_statement_data(filing, ticker).items():
+        print(f"    [save_filing_tables] Processing table {statement_name}...")
+        try:
+            parsed = dataframe_rows(statement_frame(table['data'])) if table['data'] else None
+            if parsed is not None:
+                title = statement_name.replace('_', ' ').title()
+                markdown_table = table_to_markdown(*parsed, title)
+            else:
+                markdown_table = statement_to_markdown(table['text'])
+            if markdown_table is None:
+                markdown_table = convert_table_with_gemini(table['text'], f"{ticker} {statement_name}")
+            if not markdown_table:
+                print(f"  Gemini API did not return a markdown table for {ticker} {form_type} {statement_name}")
+                continue
+            s3_key = f"{ticker}_{form_type}_{filing.accession_number}_{statement_name}.md"
+            upload_to_s3(markdown_table, s3_key, filing)
+        except Exception as e:
+            print(f"  Error converting table to markdown for {ticker} {form_type} {statement_name}: {e}")
+
+def list_company_filings(ticker, cik, limit=MAX_FILINGS_PER_FORM):
+    """
+    Return (form_type, filing) pairs for the latest `limit` filings of each form type.
+    """
+    print(f"Processing {ticker}...")
+    company = sec_request(Company, cik, description=f"{ticker} company")
+    selected = []
+    for form_type in FORM_TYPES:
+        try:
+            filings = sec_request(
+                company.get_filings,
+                form=form_type,
+                description=f"{ticker} {form_type} filings"
             )
-            try:
-                print(f"      [save_filing_tables] Sending {statement_name} to Gemini API...")
-                response = requests.post(
-                    GEMINI_API_URL,
-                    json={
-                        "contents": [{"parts": [{"text": prompt}]}]
-                    },
-                    timeout=120
-                )
-                response.raise_for_status()
-                data = response.json()
-                # Extract markdown from Gemini response
-                markdown_table = None
-                # Gemini's response format: data['candidates'][0]['content']['parts'][0]['text']
-                candidates = data.get('candidates', [])
-                if candidates:
-                    parts = candidates[0].get('content', {}).get('parts', [])
-                    if parts:
-                        markdown_table = parts[0].get('text', '').strip()
-                if not markdown_table:
-                    print(f"  Gemini API did not return a markdown table for {ticker} {form_type} {statement_name}")
-                    continue
-                s3_key = f"{ticker}_{form_type}_{filing.accession_number}_{statement_name}.md"
-                upload_to_s3(markdown_table, s3_key)
-                # Add delay to avoid rate limiting
-                time.sleep(2)
-            except Exception as e:
-                print(f"  Error converting table to markdown for {ticker} {form_type} {statement_name}: {e}")
+            if not filings:
+                print(f"  No {form_type} found for {ticker}")
+                continue
+            # Take the latest filings (or fewer if less available)
+            for index in range(min(limit, len(filings))):
+                selected.append((form_type, filings[index]))
+        except Exception as e:
+            print(f"  Error fetching {form_type} for {ticker}: {e}")
+    return selected
+
+def process_filing(filing, ticker, form_type):
+    """
+    Save the document and tables of one filing.
+    """
+    save_filing_document(filing, ticker, form_type)
+    save_filing_tables(filing, ticker, form_type)
+
+class Progress:
+    """
+    Counts finished filings and reports throughput and an ETA.
+
+    The total grows as company filing lists arrive, so the ETA covers the
+    filings listed so far.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+
+    def add(self, count):
+        self.total += count
+
+    def finish(self, label, error=None):
+        self.done += 1
+        if error is not None:
+            self.failed += 1
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.done) / rate if rate else 0
+        status = f"failed: {error}" if error is not None else "done"
+        print(f"[{self.done}/{self.total}] {label} {status} "
+              f"({rate * 60:.1f} filings/min, ETA {eta:.0f}s)")
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        print(f"Finished {self.done} filings ({self.failed} failed) in {elapsed:.1f}s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch SEC filings and upload them to S3.")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=FETCH_WORKERS,
+        help="Companies and filings processed in parallel"
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=MAX_FILINGS_PER_FORM,
+        help="Latest filings to fetch per company and form type"
+    )
+    return parser.parse_args()
 
 def main():
-    for ticker, cik in COMPANIES.items():
-        print(f"Processing {ticker}...")
-        company = Company(cik)
-        for form_type in FORM_TYPES:
-            try:
-                print("Getting filings")
-                filings = company.get_filings(form=form_type)
-                print("Got filings")
-                if not filings:
-                    print(f"  No {form_type} found for {ticker}")
-                    continue
-                # Save the latest 10 filings (or fewer if less available)
-                for index in range(10):
-                    filing = filings[index]
-                    save_filing_document(filing, ticker, form_type)
-                    save_filing_tables(filing, ticker, form_type)
-            except Exception as e:
-                print(f"  Error fetching {form_type} for {ticker}: {e}")
+    """
+    Fetch filings for all companies concurrently.
+
+    Company filing lists and individual filings are processed on one thread
+    pool; every HTTP request to SEC takes a token from one shared limiter, so
+    adding workers raises throughput only up to SEC's request rate.
+    """
+    args = parse_args()
+    limit_sec_http_requests(sec_limiter)
+    progress = Progress()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = {
+            executor.submit(list_company_filings, ticker, cik, args.limit): ('list', ticker)
+            for ticker, cik in COMPANIES.items()
+        }
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, label = pending.pop(future)
+                if kind == 'list':
+                    try:
+                        filings = future.result()
+                    except Exception as e:
+                        print(f"  Error fetching filings for {label}: {e}")
+                        continue
+                    progress.add(len(filings))
+                    for form_type, filing in filings:
+                        job = executor.submit(process_filing, filing, label, form_type)
+                        pending[job] = ('filing', f"{label} {form_type} {filing.accession_number}")
+                else:
+                    progress.finish(label, future.exception())
+
+    uploads = s3_uploader.close()
+    progress.summary()
+    print(f"S3: {uploads['uploaded']} uploaded, {uploads['skipped']} unchanged, "
+          f"{uploads['failed']} failed ({uploads['raw_bytes'] / 1024 ** 2:.1f} MB compressed "
+          f"to {uploads['sent_bytes'] / 1024 ** 2:.1f} MB)")
+    stats = filing_cache.stats()
+    print(f"Filing cache: {stats['hits']} hits, {stats['misses']} misses, "
+          f"{stats['entries']} entries ({stats['bytes'] / 1024 ** 2:.1f} MB)")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,144 @@
+import os
+import re
+import gzip
+import time
+import threading
+
+UNSAFE_NAME_CHARS = re.compile(r'[^A-Za-z0-9._-]')
+
+
+class FilingCache:
+    """
+    On-disk, gzip-compressed cache of downloaded filing content.
+
+    Entries are keyed by accession number and a name (e.g. 'document.md'). A
+    filing never changes once filed, so entries never go stale and are only
+    removed to respect max_bytes: reads refresh an entry's modification time,
+    and the least recently used entries are deleted once the cache grows past
+    the cap. Safe to share between threads.
+    """
+
+    SUFFIX = '.gz'
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # path -> [compressed size, last used], seeded from what earlier runs left
+        self.entries = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(self.SUFFIX):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    self.entries[path] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def path(self, accession, name):
+        return os.path.join(
+            self.directory,
+            UNSAFE_NAME_CHARS.sub('_', accession),
+            UNSAFE_NAME_CHARS.sub('_', name) + self.SUFFIX
+        )
+
+    def get(self, accession, name):
+        """
+        Return cached text, or None if it is not cached.
+        """
+        path = self.path(accession, name)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        except (OSError, EOFError) as e:
+            print(f"  Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.hits += 1
+            if path in self.entries:
+                self.entries[path][1] = now
+        return text
+
+    def put(self, accession, name, text):
+        """
+        Store text, then evict least recently used entries if over the size cap.
+        """
+        path = self.path(accession, name)
+        data = gzip.compress(text.encode('utf-8'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial entry
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            previous = self.entries.get(path)
+            if previous is not None:
+                self.total_bytes -= previous[0]
+            self.entries[path] = [len(data), time.time()]
+            self.total_bytes += len(data)
+            self._evict()
+
+    def get_or_fetch(self, accession, name, fetch):
+        """
+        Return cached text, calling fetch() and caching its result on a miss.
+        """
+        text = self.get(accession, name)
+        if text is None:
+            text = fetch()
+            self.put(accession, name, text)
+        return text
+
+    def _evict(self):
+        # Called with self.lock held
+        if self.total_bytes <= self.max_bytes:
+            return
+        for path, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._delete(path)
+            del self.entries[path]
+            self.total_bytes -= size
+
+    def _remove(self, path):
+        self._delete(path)
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.total_bytes -= entry[0]
+
+    @staticmethod
+    def _delete(path):
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            # Already gone, or the accession directory still has other entries
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes
+            }
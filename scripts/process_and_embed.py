@@ -1,16 +1,27 @@
 import os
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct
+from qdrant_client.models import PointStruct, PointIdsList, SparseVector
 from sentence_transformers import SentenceTransformer
-import uuid
+from marketsight_common.embedding_cache import EmbeddingCache
+from marketsight_common.sparse_encoder import SPARSE_VECTOR_NAME, encode_document
+from s3_transfer import PERIOD_OF_REPORT_KEY
 from utils import (
-    get_markdown_files_from_s3,
-    read_file_from_s3,
+    get_markdown_objects_from_s3,
+    read_files_from_s3,
+    matches_filters,
     setup_markdown_splitter,
     setup_qdrant_collection,
-    estimate_point_size,
-    calculate_optimal_batch_size,
+    prefetch,
+    UpsertWriter,
+    point_id,
+    filing_metadata,
+    IndexManifest,
     COLLECTION_NAME
 )
 
@@ -26,147 +37,471 @@ qdrant_client = QdrantClient(
     api_key=QDRANT_API_KEY
 )
 
-# Initialize embedding model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embedding model and splitter, loaded once per process on first use
+embedding_model = None
+markdown_splitter = None
 
+# Number of chunks passed to a single encode call
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
 
-def embed_and_store_chunks(chunks):
+# Chunks embedded and upserted together; bounds memory and time to first upsert
+EMBED_WINDOW_SIZE = int(os.getenv('EMBED_WINDOW_SIZE', '512'))
+
+# Maximum items buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '4'))
+
+# Embeddings of recently seen chunk texts, so boilerplate repeated across
+# filings (e.g. forward-looking statements) is encoded once per process
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', '20000'))
+embedding_cache = None
+
+
+def load_embedding_model():
+    """
+    Load the embedding model on first use so worker processes each load it exactly once.
+
+    The embedding cache is created alongside it, sized to the model's dimension.
+    """
+    global embedding_model, embedding_cache
+    if embedding_model is None:
+        embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        embedding_cache = EmbeddingCache(
+            capacity=EMBED_CACHE_SIZE,
+            dimension=embedding_model.get_sentence_embedding_dimension()
+        )
+    return embedding_model
+
+def get_markdown_splitter():
+    """
+    Create the markdown splitter on first use.
+    """
+    global markdown_splitter
+    if markdown_splitter is None:
+        markdown_splitter = setup_markdown_splitter()
+    return markdown_splitter
+
+def count_tokens(texts):
+    """
+    Count model tokens per text, falling back to character length if tokenization fails.
+    """
+    try:
+        encoded = load_embedding_model().tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        return [len(ids) for ids in encoded['input_ids']]
+    except Exception:
+        return [len(text) for text in texts]
+
+def encode_batch(texts):
     """
-    Generate embeddings for chunks and store them in Qdrant with adaptive batch processing.
+    Encode a list of texts into a float32 matrix with one row per text.
     """
+    embeddings = load_embedding_model().encode(
+        texts,
+        batch_size=len(texts),
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+    return np.asarray(embeddings, dtype=np.float32)
+
+def embed_chunks(chunks, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embed chunks in length-sorted batches.
+
+    Returns a contiguous float32 matrix and the list of chunks it covers, in input
+    order. Texts already in the embedding cache are not re-encoded. If a batch
+    fails, its chunks are retried one by one so only the failing chunks are
+    dropped.
+    """
+    dimension = load_embedding_model().get_sentence_embedding_dimension()
     if not chunks:
-        print("No chunks to embed")
-        return
-    
-    print(f"Generating embeddings for {len(chunks)} chunks...")
-    
-    points = []
-    for chunk in chunks:
+        return np.empty((0, dimension), dtype=np.float32), []
+
+    start_time = time.perf_counter()
+    texts = [chunk['content'] for chunk in chunks]
+
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+    embedded = np.zeros(len(texts), dtype=bool)
+
+    uncached = []
+    for i, text in enumerate(texts):
+        cached = embedding_cache.get(text)
+        if cached is None:
+            uncached.append(i)
+        else:
+            embeddings[i] = cached
+            embedded[i] = True
+    cached_count = len(texts) - len(uncached)
+
+    # Group chunks of similar length so each batch is padded as little as possible
+    lengths = count_tokens([texts[i] for i in uncached])
+    order = [uncached[j] for j in sorted(range(len(uncached)), key=lambda j: lengths[j])]
+
+    for start in range(0, len(order), batch_size):
+        batch_indices = order[start:start + batch_size]
         try:
-            # Generate embedding
-            embedding = embedding_model.encode(chunk['content'])
-            
-            # Create point for Qdrant
-            point = PointStruct(
-                id=str(uuid.uuid4()),
-                vector=embedding.tolist(),
-                payload={
-                    'source_file': chunk['source_file'],
-                    'chunk_index': chunk['chunk_index'],
-                    'content': chunk['content'],
-                    'metadata': chunk['metadata']
-                }
-            )
-            points.append(point)
-            
+            embeddings[batch_indices] = encode_batch([texts[i] for i in batch_indices])
+            embedded[batch_indices] = True
         except Exception as e:
-            print(f"Error processing chunk from {chunk['source_file']}: {e}")
-    
-    # Store points in Qdrant with adaptive batch processing
-    if points:
-        # Calculate optimal batch size based on content
-        batch_size = calculate_optimal_batch_size(points)
-        total_batches = (len(points) + batch_size - 1) // batch_size
-        
-        print(f"Storing {len(points)} embeddings in {total_batches} batches (batch size: {batch_size})...")
-        
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            
-            try:
-                qdrant_client.upsert(
-                    collection_name=COLLECTION_NAME,
-                    points=batch
-                )
-                print(f"  Batch {batch_num}/{total_batches}: Stored {len(batch)} embeddings")
-            except Exception as e:
-                print(f"  Error storing batch {batch_num}: {e}")
-                # If we still hit size limits, try with smaller batches
-                if "larger than allowed" in str(e) and batch_size > 10:
-                    print(f"  Payload too large, retrying with smaller batch size...")
-                    smaller_batch_size = batch_size // 2
-                    for j in range(i, min(i + batch_size, len(points)), smaller_batch_size):
-                        smaller_batch = points[j:j + smaller_batch_size]
-                        qdrant_client.upsert(
-                            collection_name=COLLECTION_NAME,
-                            points=smaller_batch
-                        )
-                        print(f"    Stored {len(smaller_batch)} embeddings (smaller batch)")
-                else:
-                    raise
-        
-        print(f"Successfully stored all {len(points)} embeddings")
-
-def process_and_chunk_files():
-    """
-    Main function to process markdown files and create structured chunks.
-    """
-    print("Setting up markdown splitter...")
-    splitter = setup_markdown_splitter()
-    
+            print(f"  Error embedding batch of {len(batch_indices)} chunks, retrying individually: {e}")
+            for i in batch_indices:
+                try:
+                    embeddings[i] = encode_batch([texts[i]])[0]
+                    embedded[i] = True
+                except Exception as e:
+                    print(f"Error processing chunk from {chunks[i]['source_file']}: {e}")
+
+        for i in batch_indices:
+            if embedded[i]:
+                embedding_cache.put(texts[i], embeddings[i])
+
+    elapsed = time.perf_counter() - start_time
+    rate = len(texts) / elapsed if elapsed > 0 else float('inf')
+    print(f"  Embedded {int(embedded.sum())}/{len(texts)} chunks ({cached_count} cached) "
+          f"in {elapsed:.2f}s ({rate:.1f} chunks/sec)")
+
+    kept = [chunk for chunk, ok in zip(chunks, embedded) if ok]
+    return np.ascontiguousarray(embeddings[embedded]), kept
+
+
+def build_points(chunks, embeddings):
+    """
+    Create Qdrant points from chunks, their embedding rows and BM25 term weights.
+    """
+    points = []
+    for chunk, embedding in zip(chunks, embeddings):
+        indices, values = encode_document(chunk['content'])
+        point = PointStruct(
+            id=chunk['id'],
+            vector={
+                '': embedding.tolist(),
+                SPARSE_VECTOR_NAME: SparseVector(indices=indices, values=values)
+            },
+            payload={
+                'source_file': chunk['source_file'],
+                'chunk_index': chunk['chunk_index'],
+                'content': chunk['content'],
+                'metadata': chunk['metadata'],
+                **chunk['filing']
+            }
+        )
+        points.append(point)
+    return points
+
+def read_documents(objects, manifest):
+    """
+    Yield the content of S3 markdown objects as concurrent reads complete,
+    skipping objects that cannot be read.
+
+    Each document carries the point IDs the manifest holds for it, so it can be
+    split and embedded without access to the manifest.
+    """
+    for obj, content, metadata in read_files_from_s3(objects):
+        print(f"Processing {obj['key']}...")
+        yield {
+            'source_file': obj['key'],
+            'etag': obj['etag'],
+            'content': content,
+            'period_of_report': metadata.get(PERIOD_OF_REPORT_KEY),
+            'stored_ids': manifest.point_ids(obj['key']),
+            'reusable_ids': list(manifest.reusable_point_ids(obj['key']))
+        }
+
+def split_document(document):
+    """
+    Split a document into structured chunks.
+
+    Chunks whose deterministic ID is already stored for the file are not
+    re-embedded, and IDs that are no longer produced are marked stale. Returns
+    None if the document cannot be split.
+    """
+    file_key = document['source_file']
+    try:
+        # Split the document into chunks
+        chunks = get_markdown_splitter().split_text(document['content'])
+    except Exception as e:
+        print(f"  Error processing {file_key}: {e}")
+        return None
+
+    filing = filing_metadata(file_key, document['content'], document.get('period_of_report'))
+    reusable_ids = set(document['reusable_ids'])
+    current_ids = []
+    new_chunks = []
+
+    # Add metadata to each chunk
+    for i, chunk in enumerate(chunks):
+        chunk_id = point_id(file_key, i, chunk.page_content)
+        current_ids.append(chunk_id)
+        if chunk_id in reusable_ids:
+            continue
+        new_chunks.append({
+            'id': chunk_id,
+            'source_file': file_key,
+            'chunk_index': i,
+            'content': chunk.page_content,
+            'metadata': chunk.metadata,
+            'filing': filing
+        })
+
+    stale_ids = set(document['stored_ids']) - set(current_ids)
+    print(f"  Created {len(chunks)} chunks from {file_key} "
+          f"({len(new_chunks)} new, {len(stale_ids)} stale)")
+
+    return {
+        'source_file': file_key,
+        'etag': document['etag'],
+        'chunks': new_chunks,
+        'current_ids': current_ids,
+        'stale_ids': list(stale_ids)
+    }
+
+def split_documents(documents):
+    """
+    Split each document into structured chunks, skipping documents that fail.
+    """
+    for document in documents:
+        chunked = split_document(document)
+        if chunked is not None:
+            yield chunked
+
+def embed_window(documents):
+    """
+    Embed the new chunks of a group of chunked documents.
+
+    Returns the documents, marked complete when all their chunks embedded and
+    carrying the IDs that will actually be stored, together with the resulting points.
+    """
+    chunks = [chunk for document in documents for chunk in document['chunks']]
+    embeddings, embedded_chunks = embed_chunks(chunks)
+
+    # Chunks that failed to embed are left out of the stored IDs, so the next
+    # run does not treat them as reusable and embeds them again
+    embedded_ids = {chunk['id'] for chunk in embedded_chunks}
+    for document in documents:
+        failed_ids = {chunk['id'] for chunk in document['chunks'] if chunk['id'] not in embedded_ids}
+        document['complete'] = not failed_ids
+        document['indexed_ids'] = [
+            chunk_id for chunk_id in document['current_ids'] if chunk_id not in failed_ids
+        ]
+        del document['chunks']
+
+    return {'documents': documents, 'points': build_points(embedded_chunks, embeddings)}
+
+def embed_documents(documents, window_size=EMBED_WINDOW_SIZE):
+    """
+    Embed chunked documents in windows of roughly window_size chunks.
+
+    Documents are grouped so small files share encode batches; each window yields
+    the documents it covers together with their points.
+    """
+    window = []
+    window_chunks = 0
+
+    for document in documents:
+        window.append(document)
+        window_chunks += len(document['chunks'])
+        if window_chunks >= window_size:
+            yield embed_window(window)
+            window = []
+            window_chunks = 0
+
+    if window:
+        yield embed_window(window)
+
+def init_worker(torch_threads):
+    """
+    Process pool initializer: split the cores between workers and load the model once.
+    """
+    import torch
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    torch.set_num_threads(torch_threads)
+    load_embedding_model()
+    get_markdown_splitter()
+
+def process_document(document):
+    """
+    Split and embed a single document inside a worker process.
+    """
+    chunked = split_document(document)
+    if chunked is None:
+        return None
+    return embed_window([chunked])
+
+def process_documents_in_workers(documents, workers):
+    """
+    Split and embed documents across a pool of worker processes.
+
+    Each worker handles one document at a time; at most 2 * workers documents are
+    in flight, and windows are yielded as workers finish them so a single writer
+    can upsert them.
+    """
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(torch_threads,)
+    ) as executor:
+        pending = set()
+        for document in documents:
+            pending.add(executor.submit(process_document, document))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result() is not None:
+                        yield future.result()
+
+        for future in pending:
+            if future.result() is not None:
+                yield future.result()
+
+def delete_points(point_ids):
+    """
+    Delete points from Qdrant by ID.
+    """
+    if point_ids:
+        qdrant_client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=PointIdsList(points=list(point_ids))
+        )
+
+def commit_documents(documents, manifest):
+    """
+    Remove stale points of stored documents and record them in the manifest.
+    """
+    for document in documents:
+        delete_points(document['stale_ids'])
+        # A partially embedded file keeps no ETag so the next run processes it
+        # again, and records only the points actually stored
+        etag = document['etag'] if document['complete'] else None
+        manifest.update(document['source_file'], etag, document['indexed_ids'])
+    manifest.save()
+
+def process_and_chunk_files(manifest, prefix='', tickers=None, form_types=None, workers=0):
+    """
+    Stream changed markdown files from S3, split them into chunks and embed them.
+
+    Files whose ETag matches the manifest are skipped without being read. Listing,
+    reading, splitting and embedding run as separate stages with bounded queues
+    between them, so only a few documents are held in memory at a time. With
+    workers > 0, splitting and embedding run in a process pool instead.
+
+    Returns a stream of windows ready to store, or None if nothing was listed.
+    """
     print("Getting markdown files from S3...")
-    markdown_files = get_markdown_files_from_s3()
+    markdown_objects = get_markdown_objects_from_s3(prefix, tickers, form_types)
     
-    if not markdown_files:
+    if not markdown_objects:
         print("No markdown files found in S3 bucket.")
-        return
-    
-    all_chunks = []
-    
-    for file_key in markdown_files:
-        print(f"Processing {file_key}...")
-        
-        content = read_file_from_s3(file_key)
-        if content is None:
-            continue
-            
-        try:
-            # Split the document into chunks
-            chunks = splitter.split_text(content)
-            
-            # Add metadata to each chunk
-            for i, chunk in enumerate(chunks):
-                chunk_data = {
-                    'source_file': file_key,
-                    'chunk_index': i,
-                    'content': chunk.page_content,
-                    'metadata': chunk.metadata
-                }
-                all_chunks.append(chunk_data)
-            
-            print(f"  Created {len(chunks)} chunks from {file_key}")
-            
-        except Exception as e:
-            print(f"  Error processing {file_key}: {e}")
+        return None
+
+    # Drop points of files in the listed scope that no longer exist in S3
+    listed_keys = {obj['key'] for obj in markdown_objects}
+    removed_keys = [
+        key for key in manifest.files
+        if key not in listed_keys and matches_filters(key, prefix, tickers, form_types)
+    ]
+    for key in removed_keys:
+        print(f"Removing points of deleted file {key}...")
+        delete_points(manifest.point_ids(key))
+        manifest.remove(key)
+    if removed_keys:
+        manifest.save()
+
+    changed_objects = [obj for obj in markdown_objects if not manifest.is_current(obj['key'], obj['etag'])]
+    print(f"{len(changed_objects)} of {len(markdown_objects)} files changed since the last run")
     
-    print(f"\nTotal chunks created: {len(all_chunks)}")
-    return all_chunks
+    documents = prefetch(read_documents(changed_objects, manifest), PIPELINE_QUEUE_SIZE)
+    if workers > 0:
+        print(f"Splitting and embedding with {workers} worker processes...")
+        return prefetch(process_documents_in_workers(documents, workers), PIPELINE_QUEUE_SIZE)
+
+    chunked = prefetch(split_documents(documents), PIPELINE_QUEUE_SIZE)
+    return prefetch(embed_documents(chunked), PIPELINE_QUEUE_SIZE)
+
+def embed_and_store_chunks(windows, manifest):
+    """
+    Store embedded windows in Qdrant as they arrive.
+
+    Upserts are pipelined by UpsertWriter; each window is recorded in the manifest
+    once all of its points are stored. Returns the number of points stored.
+    """
+    writer = UpsertWriter(qdrant_client)
+    totals = {'points': 0, 'documents': 0}
+
+    def window_stored(window):
+        commit_documents(window['documents'], manifest)
+        totals['points'] += len(window['points'])
+        totals['documents'] += len(window['documents'])
+        print(f"Stored {totals['points']} embeddings from {totals['documents']} documents so far")
+
+    try:
+        for window in windows:
+            writer.write(window['points'], on_done=lambda window=window: window_stored(window))
+    finally:
+        writer.close()
+
+    return totals['points']
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed markdown filings from S3 into Qdrant.")
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help="Ignore the index manifest and re-embed every file"
+    )
+    parser.add_argument(
+        '--recreate',
+        action='store_true',
+        help="Drop and recreate the Qdrant collection, then re-embed every file"
+    )
+    parser.add_argument('--prefix', default='', help="Only process S3 keys under this prefix")
+    parser.add_argument('--tickers', nargs='+', help="Only process filings for these tickers")
+    parser.add_argument('--forms', nargs='+', help="Only process these form types, e.g. 10-K")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=0,
+        help="Split and embed in N worker processes (0 runs in this process)"
+    )
+    return parser.parse_args()
 
 def main():
     """
     Main function to process files and store embeddings in Qdrant.
     """
+    args = parse_args()
     print("Starting MarketSight document processing pipeline...")
     
     # Step 1: Set up Qdrant collection
     print("\n1. Setting up Qdrant collection...")
-    setup_qdrant_collection(qdrant_client)
+    setup_qdrant_collection(qdrant_client, recreate=args.recreate)
+
+    manifest = IndexManifest()
+    if args.recreate:
+        manifest.files = {}
+    elif args.full:
+        # Keep stored point IDs so stale points are still cleaned up
+        for entry in manifest.files.values():
+            entry['version'] = None
     
-    # Step 2: Process and chunk files
-    print("\n2. Processing and chunking documents...")
-    chunks = process_and_chunk_files()
+    # Step 2: Stream, chunk, embed and store changed documents
+    print("\n2. Processing, embedding and storing documents...")
+    windows = process_and_chunk_files(manifest, args.prefix, args.tickers, args.forms, args.workers)
     
-    if not chunks:
-        print("No chunks generated. Exiting.")
+    if windows is None:
+        print("No documents to process. Exiting.")
         return
     
-    # Step 3: Generate embeddings and store in Qdrant
-    print("\n3. Generating embeddings and storing in Qdrant...")
-    embed_and_store_chunks(chunks)
+    total_points = embed_and_store_chunks(windows, manifest)
     
     print(f"\nPipeline completed successfully!")
-    print(f"Total documents processed and stored: {len(chunks)}")
+    print(f"Total chunks embedded and stored: {total_points}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
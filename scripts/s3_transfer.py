@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip needs only the standard library
+    zstandard = None
+
+# Object metadata holding the SHA-256 of the uncompressed content
+CONTENT_SHA256_KEY = 'content-sha256'
+
+# Object metadata holding the filing's period of report (YYYY-MM-DD)
+PERIOD_OF_REPORT_KEY = 'period-of-report'
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def content_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def encode_body(data, encoding):
+    """
+    Compress bytes for upload with the given Content-Encoding ('gzip', 'zstd' or 'identity').
+    """
+    if encoding == 'gzip':
+        # Fixed mtime so identical content always compresses to identical bytes
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=6).compress(data)
+    return data
+
+class BodyDecodeError(ValueError):
+    """A downloaded body could not be decompressed (truncated or corrupt)."""
+
+def decode_body(data, content_encoding):
+    """
+    Undo the Content-Encoding of a downloaded body.
+
+    Checks the magic bytes as well, so a body an HTTP layer has already
+    decompressed is returned unchanged. A corrupt or truncated body raises
+    BodyDecodeError, whichever codec failed.
+    """
+    try:
+        if content_encoding == 'gzip' and data[:2] == GZIP_MAGIC:
+            return gzip.decompress(data)
+        if content_encoding == 'zstd' and data[:4] == ZSTD_MAGIC:
+            if zstandard is None:
+                raise RuntimeError("Object is zstd-compressed but the zstandard package is not installed")
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            body = decompressor.decompress(data)
+            # A truncated frame decodes without error, just incompletely
+            if not decompressor.eof:
+                raise BodyDecodeError("Cannot decode zstd body: frame is incomplete")
+            return body
+    except (RuntimeError, BodyDecodeError):
+        raise
+    except Exception as e:
+        raise BodyDecodeError(f"Cannot decode {content_encoding} body: {e}") from e
+    return data
+
+class S3Uploader:
+    """
+    Compressing, deduplicating S3 uploader backed by a bounded thread pool.
+
+    Content is compressed with `encoding` and stored with the matching
+    Content-Encoding; the SHA-256 of the uncompressed content goes into the
+    object metadata next to any caller-supplied metadata. An upload is skipped
+    when the existing object already carries the same hash and metadata, so
+    unchanged objects keep their ETag. submit() blocks while 2 * max_workers
+    uploads are pending.
+    """
+
+    def __init__(self, s3_client, bucket, max_workers=8, encoding='gzip'):
+        if encoding == 'zstd' and zstandard is None:
+            print("zstandard is not installed, compressing uploads with gzip instead")
+            encoding = 'gzip'
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.encoding = encoding
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-upload')
+        self.slots = threading.BoundedSemaphore(2 * max_workers)
+        self.lock = threading.Lock()
+        self.uploaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def stored_metadata(self, s3_key):
+        """
+        User metadata of the existing object, or None if there is no object.
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=s3_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return response.get('Metadata', {})
+
+    def upload(self, content, s3_key, metadata=None):
+        """
+        Upload text unless the stored object already has identical content and metadata.
+
+        Returns True if the object was written.
+        """
+        data = content.encode('utf-8')
+        digest = content_sha256(data)
+        metadata = {**(metadata or {}), CONTENT_SHA256_KEY: digest}
+        stored = self.stored_metadata(s3_key)
+        if stored is not None and all(stored.get(key) == value for key, value in metadata.items()):
+            with self.lock:
+                self.skipped += 1
+            print(f"  Unchanged, skipped: s3://{self.bucket}/{s3_key}")
+            return False
+
+        body = encode_body(data, self.encoding)
+        extra = {'ContentEncoding': self.encoding} if self.encoding != 'identity' else {}
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=s3_key,
+            Body=body,
+            ContentType='text/markdown; charset=utf-8',
+            Metadata=metadata,
+            **extra
+        )
+        with self.lock:
+            self.uploaded += 1
+            self.raw_bytes += len(data)
+            self.sent_bytes += len(body)
+        print(f"  Uploaded to S3: s3://{self.bucket}/{s3_key}")
+        return True
+
+    def _upload_and_release(self, content, s3_key, metadata):
+        try:
+            return self.upload(content, s3_key, metadata)
+        except Exception as e:
+            # Nobody may be waiting on the future, so record the failure here
+            with self.lock:
+                self.failed += 1
+            print(f"  Error uploading to S3: {e}")
+            return False
+        finally:
+            self.slots.release()
+
+    def submit(self, content, s3_key, metadata=None):
+        """
+        Queue an upload, waiting for a free slot first. Returns a Future.
+        """
+        self.slots.acquire()
+        try:
+            return self.executor.submit(self._upload_and_release, content, s3_key, metadata)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def close(self):
+        """
+        Wait for pending uploads and return upload statistics.
+        """
+        self.executor.shutdown(wait=True)
+        return self.stats()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'uploaded': self.uploaded,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'raw_bytes': self.raw_bytes,
+                'sent_bytes': self.sent_bytes
+            }
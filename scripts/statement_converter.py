@@ -0,0 +1,198 @@
+import re
+import math
+import numbers
+
+# Column separators rich draws between cells; other box-drawing characters
+# (U+2500-U+257F) and the ASCII box style only appear in rules and borders
+VERTICAL_CHARS = '│┃║┆┇┊┋|'
+RULE_CHARS = set('+-=: ' + VERTICAL_CHARS)
+
+COLUMN_GAP = re.compile(r'\s{2,}')
+
+# Statement DataFrame columns holding values are named after their period
+# ('2023-09-30', '2023'); the rest (concept, level, units, ...) are metadata
+PERIOD_COLUMN = re.compile(r'(?:19|20)\d{2}')
+VALUE_PATTERN = re.compile(
+    r'^(?:'
+    r'[$€£]?\s*\(?\s*[$€£]?\s*-?\d[\d,]*(?:\.\d+)?\s*\)?\s*%?'  # 1,234  $(5.6)  12.5%
+    r'|[-–—]+'                                                   # nil markers
+    r')$'
+)
+
+
+def is_rule(line):
+    stripped = line.strip()
+    return (
+        len(stripped) >= 3
+        and all(char in RULE_CHARS or '\u2500' <= char <= '\u257f' for char in stripped)
+        and any(char not in VERTICAL_CHARS + ' ' for char in stripped)
+    )
+
+def is_bordered(line):
+    return not is_rule(line) and any(char in VERTICAL_CHARS for char in line)
+
+def bordered_cells(line, left_border, right_border):
+    # Outer borders leave an empty piece on either side; without them (e.g.
+    # rich's MINIMAL box) a trailing piece is an empty last cell
+    cells = re.split(f'[{VERTICAL_CHARS}]', line.rstrip())
+    if left_border:
+        cells = cells[1:]
+    if right_border:
+        cells = cells[:-1]
+    return [cell.strip() for cell in cells]
+
+def spaced_cells(line):
+    return COLUMN_GAP.split(line.strip())
+
+def is_value(cell):
+    return cell == '' or VALUE_PATTERN.match(cell) is not None
+
+def markdown_row(cells):
+    return '| ' + ' | '.join(cell.replace('|', '\\|') for cell in cells) + ' |'
+
+def parse_rows(lines, bordered):
+    """
+    Split table lines into header cells and body rows, or return None.
+
+    Every body row must have a cell per column, except section labels such as
+    'ASSETS', which are a single non-numeric cell. Tables rendered too narrow
+    (cells truncated with an ellipsis) are rejected.
+    """
+    header_lines, body_lines = lines
+    if bordered:
+        # A border is drawn on every line; a blank edge cell only on some
+        outlines = [line.strip() for line in header_lines + body_lines]
+        left_border = all(outline[0] in VERTICAL_CHARS for outline in outlines)
+        right_border = all(outline[-1] in VERTICAL_CHARS for outline in outlines)
+
+        def split(line):
+            return bordered_cells(line, left_border, right_border)
+    else:
+        split = spaced_cells
+    headers = [split(line) for line in header_lines]
+
+    if bordered:
+        # Wrapped header cells span several lines; join them column by column
+        if len({len(cells) for cells in headers}) != 1:
+            return None
+        header = [' '.join(part for part in column if part) for column in zip(*headers)]
+    elif len(headers) == 1:
+        header = headers[0]
+    else:
+        return None
+
+    rows = [cells for cells in (split(line) for line in body_lines) if any(cells)]
+    if not bordered:
+        widths = {len(cells) for cells in rows if len(cells) > 1}
+        if widths == {len(header) + 1}:
+            # The label column often has no heading
+            header = [''] + header
+        rows = [cells + [''] * (len(header) - 1) if len(cells) == 1 else cells for cells in rows]
+
+    if len(header) < 2 or not rows:
+        return None
+    if any('…' in cell for cells in [header] + rows for cell in cells):
+        return None
+    for cells in rows:
+        if len(cells) != len(header):
+            return None
+        if not cells[0] and any(cells[1:]):
+            return None
+        if not all(is_value(cell) for cell in cells[1:]):
+            return None
+    return header, rows
+
+def value_text(value):
+    """
+    Format a statement value: numbers with thousands separators, missing values as ''.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        if math.isnan(value):
+            return ''
+        if float(value).is_integer():
+            return f"{int(value):,}"
+        return f"{value:,}"
+    text = str(value)
+    # pandas' missing-value markers in nullable columns
+    return '' if text in ('<NA>', 'NaT') else text
+
+def dataframe_rows(frame):
+    """
+    Header and rows of a statement DataFrame as strings, or None.
+
+    Keeps the line-item label (the 'label' column, else the index) and the
+    period columns, in their original order. Line items without values, such
+    as 'ASSETS', become section labels. Returns None when no column is named
+    after a period, so the caller can fall back to the rendered text.
+    """
+    periods = [column for column in frame.columns if PERIOD_COLUMN.search(str(column))]
+    if not periods:
+        return None
+    labels = frame['label'] if 'label' in frame.columns else frame.index
+
+    rows = []
+    for label, values in zip(labels, frame[periods].itertuples(index=False, name=None)):
+        cells = [value_text(label)] + [value_text(value) for value in values]
+        if any(cells):
+            rows.append(cells)
+    if not rows:
+        return None
+    return [''] + [str(column) for column in periods], rows
+
+def table_to_markdown(header, rows, title=None):
+    """
+    Render header cells and body rows as a markdown table, with an optional title line above.
+    """
+    table = [markdown_row(header), markdown_row(['---'] * len(header))]
+    table += [markdown_row(cells) for cells in rows]
+    return '\n'.join(([title, ''] if title else []) + table)
+
+def statement_to_markdown(text):
+    """
+    Convert the text rendering of a financial statement to a markdown table.
+
+    Used when a statement's structured data cannot be converted with
+    dataframe_rows(). Handles the tables edgartools renders with rich, with column lines in any
+    box style or with space-aligned columns: title lines above the header are kept as plain text,
+    the header row becomes the table header, and every other row must be a
+    label followed by numeric values (or a lone section label). Returns None for
+    anything that does not fit, so the caller can fall back to another converter.
+    """
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+
+    def is_header(index, bordered):
+        line = lines[index]
+        if is_rule(line):
+            return False
+        return is_bordered(line) if bordered else len(spaced_cells(line)) > 1
+
+    # The header is the block of lines directly above the first rule that
+    # follows a multi-column line; a top border or a rule under the title is skipped
+    separator = next(
+        (
+            i for i, line in enumerate(lines)
+            if i > 0 and is_rule(line) and (is_header(i - 1, True) or is_header(i - 1, False))
+        ),
+        None
+    )
+    if separator is None:
+        return None
+    bordered = is_bordered(lines[separator - 1])
+    start = separator
+    while start > 0 and is_header(start - 1, bordered):
+        start -= 1
+    title = [line.strip() for line in lines[:start] if not is_rule(line)]
+    header_lines = lines[start:separator]
+    body_lines = [line for line in lines[separator + 1:] if not is_rule(line)]
+    if bordered and not all(is_bordered(line) for line in body_lines):
+        return None
+
+    parsed = parse_rows((header_lines, body_lines), bordered)
+    if parsed is None:
+        return None
+    header, rows = parsed
+    return table_to_markdown(header, rows, '\n'.join(title))
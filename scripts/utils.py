@@ -1,11 +1,22 @@
 import os
+import re
 import boto3
-import sys
+import json
+import time
+import uuid
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
 from langchain_text_splitters import MarkdownHeaderTextSplitter
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+from qdrant_client.models import Distance, VectorParams, PayloadSchemaType, SparseVectorParams, Modifier
+
+from marketsight_common.sparse_encoder import SPARSE_VECTOR_NAME
+from s3_transfer import decode_body
 
 load_dotenv()
 
@@ -14,12 +25,21 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'ap-south-1')
 S3_BUCKET = os.getenv('S3_BUCKET')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # Optional local S3 stand-in (moto server, MinIO)
+
+# Concurrent GETs used by the bulk reader; the connection pool is sized to match
+S3_READ_WORKERS = int(os.getenv('S3_READ_WORKERS', '16'))
 
 s3_client = boto3.client(
     's3',
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+    region_name=AWS_REGION,
+    endpoint_url=S3_ENDPOINT_URL,
+    config=Config(
+        max_pool_connections=S3_READ_WORKERS,
+        retries={'max_attempts': 5, 'mode': 'adaptive'}
+    )
 )
 
 # Qdrant configuration
@@ -27,36 +47,234 @@ QDRANT_URL = os.getenv('QDRANT_URL', 'http://localhost:6333')
 QDRANT_API_KEY = os.getenv('QDRANT_API_KEY')
 COLLECTION_NAME = 'market_insights'
 
-def get_markdown_files_from_s3():
+# Payload fields indexed for filtered retrieval
+PAYLOAD_INDEXES = {
+    'ticker': PayloadSchemaType.KEYWORD,
+    'form_type': PayloadSchemaType.KEYWORD,
+    'fiscal_year': PayloadSchemaType.INTEGER
+}
+
+# Local record of indexed S3 objects used for incremental re-indexing
+INDEX_MANIFEST_PATH = os.getenv('INDEX_MANIFEST_PATH', 'data/index_manifest.json')
+
+# Bump when the point payload or vector layout changes to force a re-embed
+INDEX_VERSION = 4
+
+# Upsert batch limits; Qdrant rejects request bodies over 32MB by default
+QDRANT_MAX_BATCH_BYTES = int(os.getenv('QDRANT_MAX_BATCH_BYTES', str(16 * 1024 * 1024)))
+QDRANT_MAX_BATCH_POINTS = int(os.getenv('QDRANT_MAX_BATCH_POINTS', '256'))
+QDRANT_UPSERTS_IN_FLIGHT = int(os.getenv('QDRANT_UPSERTS_IN_FLIGHT', '4'))
+
+# Namespace for deterministic point IDs
+POINT_ID_NAMESPACE = uuid.UUID('6f1c3a52-8d4e-4b7a-9c2f-3e5d7a1b9c40')
+
+def parse_s3_key(s3_key):
     """
-    Retrieve all markdown files from S3 bucket.
+    Parse a filing key such as AAPL_10-K_<accession>[_<statement>].md.
+
+    Returns a dict with ticker, form_type, accession_number and statement (None
+    for the main document), or None if the key does not follow the convention.
+    """
+    name = s3_key.rsplit('/', 1)[-1]
+    if not name.endswith('.md'):
+        return None
+    parts = name[:-len('.md')].split('_', 3)
+    if len(parts) < 3:
+        return None
+    return {
+        'ticker': parts[0],
+        'form_type': parts[1],
+        'accession_number': parts[2],
+        'statement': parts[3] if len(parts) > 3 else None
+    }
+
+# Cover page wording, allowing markdown emphasis around the date
+FISCAL_YEAR_PATTERN = re.compile(
+    r'fiscal\s+year\s+ended[\s*_]+[A-Za-z]+\s+\d{1,2},?\s+(\d{4})',
+    re.IGNORECASE
+)
+
+def filing_metadata(s3_key, content, period_of_report=None):
+    """
+    Structured filing fields stored in each chunk's payload for filtered search.
+
+    Ticker, form type and accession number come from the key. The fiscal year
+    is the year of the filing's period of report, which fetch_reports records
+    in the object metadata; objects uploaded without it fall back to the cover
+    page ("For the fiscal year ended September 28, 2024"). If neither is
+    available the fiscal year is None rather than a guess.
+    """
+    parsed = parse_s3_key(s3_key) or {}
+
+    fiscal_year = None
+    if period_of_report and re.match(r'\d{4}-\d{2}-\d{2}', period_of_report):
+        fiscal_year = int(period_of_report[:4])
+    else:
+        match = FISCAL_YEAR_PATTERN.search(content[:20000])
+        if match:
+            fiscal_year = int(match.group(1))
+
+    return {
+        'ticker': parsed['ticker'].upper() if parsed.get('ticker') else None,
+        'form_type': parsed.get('form_type'),
+        'accession_number': parsed.get('accession_number'),
+        'statement': parsed.get('statement'),
+        'fiscal_year': fiscal_year
+    }
+
+def matches_filters(s3_key, prefix='', tickers=None, form_types=None):
+    """
+    Whether a markdown key falls under the prefix and the ticker/form filters.
+    """
+    if not s3_key.startswith(prefix) or not s3_key.endswith('.md'):
+        return False
+    if not tickers and not form_types:
+        return True
+    parsed = parse_s3_key(s3_key)
+    if parsed is None:
+        return False
+    if tickers and parsed['ticker'].upper() not in {t.upper() for t in tickers}:
+        return False
+    if form_types and parsed['form_type'].upper() not in {f.upper() for f in form_types}:
+        return False
+    return True
+
+def iter_markdown_objects(prefix='', tickers=None, form_types=None):
+    """
+    Yield markdown objects under a prefix as dicts with their key and ETag.
+
+    Follows continuation tokens, so buckets with more than 1000 keys are listed
+    completely.
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if matches_filters(obj['Key'], prefix, tickers, form_types):
+                yield {'key': obj['Key'], 'etag': obj['ETag']}
+
+def get_markdown_objects_from_s3(prefix='', tickers=None, form_types=None):
+    """
+    Retrieve all matching markdown objects from S3 bucket.
+
+    Returns an empty list if listing fails part way, so callers never act on a
+    partial listing.
     """
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix='')
-        markdown_files = []
-        
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                if obj['Key'].endswith('.md'):
-                    markdown_files.append(obj['Key'])
-        
-        return markdown_files
+        return list(iter_markdown_objects(prefix, tickers, form_types))
     except (NoCredentialsError, ClientError) as e:
         print(f"Error listing S3 objects: {e}")
         return []
 
+def get_markdown_files_from_s3(prefix='', tickers=None, form_types=None):
+    """
+    Retrieve all matching markdown files from S3 bucket.
+    """
+    return [obj['key'] for obj in get_markdown_objects_from_s3(prefix, tickers, form_types)]
+
 def read_file_from_s3(s3_key):
     """
-    Read a markdown file from S3.
+    Read a markdown file from S3, decompressing gzip or zstd Content-Encoding.
+
+    Returns (content, user metadata), or None if the object cannot be read.
     """
     try:
         response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
-        content = response['Body'].read().decode('utf-8')
-        return content
-    except (NoCredentialsError, ClientError) as e:
+        body = decode_body(response['Body'].read(), response.get('ContentEncoding'))
+        content = body.decode('utf-8')
+        return content, response.get('Metadata', {})
+    except (NoCredentialsError, ClientError, OSError, RuntimeError, ValueError) as e:
+        # ValueError covers corrupt compressed bodies and invalid UTF-8
         print(f"Error reading {s3_key} from S3: {e}")
         return None
 
+def read_files_from_s3(objects, max_workers=S3_READ_WORKERS):
+    """
+    Read S3 objects concurrently and yield (object, content, metadata) as they arrive.
+
+    Objects may be keys or dicts with a 'key' entry. At most 2 * max_workers reads
+    are in flight, so a slow consumer does not cause unbounded buffering.
+    Objects that cannot be read are skipped.
+    """
+    objects = iter(objects)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            obj = next(objects, None)
+            if obj is None:
+                return False
+            key = obj['key'] if isinstance(obj, dict) else obj
+            pending[executor.submit(read_file_from_s3, key)] = obj
+            return True
+
+        while len(pending) < 2 * max_workers and submit_next():
+            pass
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                obj = pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    yield (obj,) + result
+                submit_next()
+
+def point_id(source_file, chunk_index, content):
+    """
+    Deterministic Qdrant point ID for a chunk, so re-indexing overwrites instead of duplicating.
+    """
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{source_file}:{chunk_index}:{content_hash}"))
+
+class IndexManifest:
+    """
+    JSON record of the S3 ETag and point IDs stored for each indexed file.
+    """
+    def __init__(self, path=INDEX_MANIFEST_PATH):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def is_current(self, key, etag):
+        """
+        Whether the file was fully indexed from this exact object version.
+        """
+        entry = self.files.get(key)
+        return bool(entry) and entry.get('version') == INDEX_VERSION and entry.get('etag') == etag
+
+    def point_ids(self, key):
+        """
+        Point IDs previously stored for a file.
+        """
+        return self.files.get(key, {}).get('point_ids', [])
+
+    def reusable_point_ids(self, key):
+        """
+        Previously stored point IDs that are still valid for the current index version.
+        """
+        entry = self.files.get(key, {})
+        return set(entry.get('point_ids', [])) if entry.get('version') == INDEX_VERSION else set()
+
+    def update(self, key, etag, point_ids):
+        self.files[key] = {'etag': etag, 'version': INDEX_VERSION, 'point_ids': point_ids}
+
+    def remove(self, key):
+        self.files.pop(key, None)
+
+    def save(self):
+        """
+        Write the manifest atomically so an interrupted run never leaves it corrupt.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
 def setup_markdown_splitter():
     """
     Configure markdown-aware text splitter with appropriate separators.
@@ -77,14 +295,21 @@ def setup_markdown_splitter():
     
     return markdown_splitter
 
-def setup_qdrant_collection(qdrant_client):
+def setup_qdrant_collection(qdrant_client, recreate=False):
     """
-    Set up Qdrant collection for storing embeddings.
+    Set up Qdrant collection for storing dense embeddings and BM25 sparse vectors.
+
+    With recreate=True an existing collection is dropped first.
     """
     try:
         # Check if collection exists
         collections = qdrant_client.get_collections()
         collection_names = [col.name for col in collections.collections]
+
+        if recreate and COLLECTION_NAME in collection_names:
+            print(f"Deleting Qdrant collection: {COLLECTION_NAME}")
+            qdrant_client.delete_collection(collection_name=COLLECTION_NAME)
+            collection_names.remove(COLLECTION_NAME)
         
         if COLLECTION_NAME not in collection_names:
             print(f"Creating Qdrant collection: {COLLECTION_NAME}")
@@ -93,37 +318,223 @@ def setup_qdrant_collection(qdrant_client):
                 vectors_config=VectorParams(
                     size=384,  # all-MiniLM-L6-v2 produces 384-dimensional vectors
                     distance=Distance.COSINE
-                )
+                ),
+                # IDF is applied by Qdrant at query time, so the BM25 index stays incremental
+                sparse_vectors_config={
+                    SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)
+                }
             )
             print(f"Collection {COLLECTION_NAME} created successfully")
         else:
             print(f"Collection {COLLECTION_NAME} already exists")
+            sparse_vectors = qdrant_client.get_collection(COLLECTION_NAME).config.params.sparse_vectors or {}
+            if SPARSE_VECTOR_NAME not in sparse_vectors:
+                raise RuntimeError(
+                    f"Collection {COLLECTION_NAME} has no '{SPARSE_VECTOR_NAME}' sparse vector; "
+                    "rerun with --recreate to rebuild it for hybrid search"
+                )
+
+        # Index filing fields so filtered queries only score matching points
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            qdrant_client.create_payload_index(
+                collection_name=COLLECTION_NAME,
+                field_name=field_name,
+                field_schema=field_schema
+            )
             
     except Exception as e:
         print(f"Error setting up Qdrant collection: {e}")
         raise
 
-def estimate_point_size(point):
+def serialized_point_size(point):
     """
-    Estimate the serialized size of a point in bytes.
+    Size in bytes of a point as sent to Qdrant in an upsert request body.
     """
-    # UUID (36 chars) + vector (384 floats * 8 bytes) + payload content
-    base_size = 36 + 384 * 8
-    payload_size = sys.getsizeof(str(point.payload))
-    return base_size + payload_size
+    vector = point.vector
+    if isinstance(vector, dict):
+        vector = {
+            name: value.model_dump() if hasattr(value, 'model_dump') else value
+            for name, value in vector.items()
+        }
+    return len(json.dumps({'id': point.id, 'vector': vector, 'payload': point.payload}))
 
-def calculate_optimal_batch_size(sample_points, max_payload_bytes=30 * 1024 * 1024):  # 30MB safety margin
+class UpsertWriter:
     """
-    Calculate optimal batch size based on estimated payload sizes.
+    Upserts points to Qdrant in byte-sized batches with several batches in flight.
+
+    Batches are cut from the actual serialized size of each point. A batch that
+    Qdrant rejects as too large is split in half recursively until it fits.
     """
-    if not sample_points:
-        return 50
-    
-    # Estimate size of a few sample points
-    sample_size = min(5, len(sample_points))
-    total_size = sum(estimate_point_size(point) for point in sample_points[:sample_size])
-    avg_point_size = total_size / sample_size
-    
-    # Calculate batch size with safety margin
-    optimal_batch_size = int(max_payload_bytes / avg_point_size)
-    return max(10, min(optimal_batch_size, 500))  # Between 10 and 500
\ No newline at end of file
+    def __init__(
+        self,
+        qdrant_client,
+        collection_name=COLLECTION_NAME,
+        max_batch_bytes=QDRANT_MAX_BATCH_BYTES,
+        max_batch_points=QDRANT_MAX_BATCH_POINTS,
+        max_in_flight=QDRANT_UPSERTS_IN_FLIGHT,
+        wait=False
+    ):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_points = max_batch_points
+        self.wait = wait
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.futures = set()
+        self.latencies = []
+        self.error = None
+
+    def batches(self, points):
+        """
+        Group points into batches under the byte and point limits.
+        """
+        batch = []
+        batch_bytes = 0
+        for point in points:
+            size = serialized_point_size(point)
+            if batch and (batch_bytes + size > self.max_batch_bytes or len(batch) >= self.max_batch_points):
+                yield batch, batch_bytes
+                batch = []
+                batch_bytes = 0
+            batch.append(point)
+            batch_bytes += size
+        if batch:
+            yield batch, batch_bytes
+
+    def upsert(self, batch, batch_bytes):
+        """
+        Upsert one batch, splitting it recursively if Qdrant rejects its size.
+        """
+        start = time.perf_counter()
+        try:
+            self.qdrant_client.upsert(
+                collection_name=self.collection_name,
+                points=batch,
+                wait=self.wait
+            )
+        except Exception as e:
+            if "larger than allowed" in str(e) and len(batch) > 1:
+                print(f"  Batch of {len(batch)} points ({batch_bytes} bytes) too large, splitting...")
+                middle = len(batch) // 2
+                for half in (batch[:middle], batch[middle:]):
+                    self.upsert(half, sum(serialized_point_size(point) for point in half))
+                return
+            raise
+
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(latency)
+        print(f"  Stored {len(batch)} embeddings ({batch_bytes / 1024:.0f} KB) in {latency * 1000:.0f} ms")
+
+    def write(self, points, on_done=None):
+        """
+        Queue points for upsert, blocking while max_in_flight batches are pending.
+
+        on_done is called once every batch of these points is stored. Callbacks run
+        one at a time, and never run if any of the batches failed.
+        """
+        if self.error:
+            raise self.error
+
+        batches = list(self.batches(points))
+        if not batches:
+            if on_done:
+                with self.lock:
+                    on_done()
+            return
+
+        remaining = [len(batches)]
+
+        def batch_done(future):
+            self.slots.release()
+            error = future.exception()
+            with self.lock:
+                self.futures.discard(future)
+                if error:
+                    self.error = self.error or error
+                    print(f"  Error storing batch: {error}")
+                    return
+                remaining[0] -= 1
+                if remaining[0] == 0 and on_done and not self.error:
+                    try:
+                        on_done()
+                    except Exception as e:
+                        self.error = e
+                        print(f"  Error after storing batch: {e}")
+
+        for batch, batch_bytes in batches:
+            self.slots.acquire()
+            future = self.executor.submit(self.upsert, batch, batch_bytes)
+            with self.lock:
+                self.futures.add(future)
+            future.add_done_callback(batch_done)
+
+    def close(self):
+        """
+        Wait for pending batches, report latency and re-raise the first failure.
+        """
+        self.executor.shutdown(wait=True)
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"Upserted {len(latencies)} batches: p50 {p50 * 1000:.0f} ms, "
+                  f"p95 {p95 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+        if self.error:
+            raise self.error
+
+class _PrefetchError:
+    """
+    Wraps an exception raised by a prefetch producer thread.
+    """
+    def __init__(self, error):
+        self.error = error
+
+_PREFETCH_DONE = object()
+
+def prefetch(iterable, maxsize):
+    """
+    Consume an iterable in a background thread, buffering at most maxsize items.
+
+    Chaining prefetch calls turns a series of generators into a pipeline whose
+    stages run concurrently with bounded queues between them. Exceptions raised
+    by the producer are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        # Time out periodically so an abandoned consumer does not block the producer forever
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_PrefetchError(e))
+        finally:
+            put(_PREFETCH_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _PREFETCH_DONE:
+                return
+            if isinstance(item, _PrefetchError):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()